@@ -1,23 +1,103 @@
-import time
 import sys
+import time
+import atexit
+import random
+import signal
+
+class TimingStats:
+    # count, total and max are exact. p99 comes from a fixed-size reservoir sample, so memory does not grow with calls
+    Reservoir = 10000
+
+    def __init__(self, name: str):
+        self.name = name
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = []
+
+    def add(self, spent: float):
+        self.count += 1
+        self.total += spent
+        if spent > self.max:
+            self.max = spent
+        if len(self.samples) < TimingStats.Reservoir:
+            self.samples.append(spent)
+        else:
+            i = random.randrange(self.count)
+            if i < TimingStats.Reservoir:
+                self.samples[i] = spent
+
+    def percentile(self, p: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+    def __str__(self) -> str:
+        return "%-32s calls %9d  total %11.1f ms  avg %9.3f ms  p99 %9.3f ms  max %9.3f ms" % (
+            self.name, self.count, self.total * 1000.0, self.total * 1000.0 / self.count if self.count else 0.0,
+            self.percentile(0.99) * 1000.0, self.max * 1000.0)
 
 class CTimingUtil:
+    # @timing only registers a function and returns it as is. enable() swaps the registered functions
+    # for wrappers that aggregate per-function latencies, so a run without --profile pays nothing.
+    # time of a recursive function is counted on every level
     timingLoggerWrapper = None
+    registry = []
+    stats = {}
+    enabled = False
 
     @staticmethod
     def timing_impl(f):
+        CTimingUtil.registry.append(f)
+        return f
+
+    @staticmethod
+    def makeWrapper(f):
+        stats = CTimingUtil.stats.setdefault(f.__qualname__, TimingStats(f.__qualname__))
+        clock = time.perf_counter
         def wrap(*args, **kwargs):
-            time1 = time.time()
-            sarg = str(args)
-            skwarg = str(kwargs)
-            ret = f(*args, **kwargs)
-            time2 = time.time()
-            msg = f"{f.__name__} function took {((time2 - time1) * 1000.0)} ms. args({sarg},k: {skwarg})"
-            if CTimingUtil.timingLoggerWrapper:
-                CTimingUtil.timingLoggerWrapper.verboseLog(msg)
-            else:
-                print("no logger")
-                sys.exit(-1)
-            return ret
+            start = clock()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                stats.add(clock() - start)
+        wrap.__name__ = f.__name__
+        wrap.__qualname__ = f.__qualname__
+        wrap.__doc__ = f.__doc__
+        wrap.__wrapped__ = f
         return wrap
 
+    @staticmethod
+    def enable():
+        # methods are found again by module and qualified name. functions local to another function cannot be reached
+        if CTimingUtil.enabled:
+            return
+        CTimingUtil.enabled = True
+        for f in CTimingUtil.registry:
+            owner = sys.modules.get(f.__module__)
+            path = f.__qualname__.split(".")
+            for name in path[:-1]:
+                owner = getattr(owner, name, None)
+            if owner is None or getattr(owner, path[-1], None) is not f:
+                continue
+            setattr(owner, path[-1], CTimingUtil.makeWrapper(f))
+        atexit.register(CTimingUtil.dump)
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, lambda signum, frame: CTimingUtil.dump())
+
+    @staticmethod
+    def summary() -> str:
+        lines = ["profile:"]
+        for stats in sorted(CTimingUtil.stats.values(), key=lambda s: s.total, reverse=True):
+            if stats.count:
+                lines.append(str(stats))
+        return "\n".join(lines)
+
+    @staticmethod
+    def dump():
+        msg = CTimingUtil.summary()
+        if CTimingUtil.timingLoggerWrapper:
+            for line in msg.splitlines():
+                CTimingUtil.timingLoggerWrapper.writeMsg(line)
+        print(msg, file=sys.stderr)
@@ -4,6 +4,19 @@ import hashlib
 import datetime
 import sys
 
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+try:
+    import crc32c
+except ImportError:
+    crc32c = None
+
 from . import TimingUtil
 from . import StrUtils
 
@@ -33,7 +46,52 @@ def eprint(*args, **kwargs):
 def mpSeed() -> str:
     return "p%d_%d" % (os.getpid(), mstime())
 
+class Crc32cHasher:
+    block_size = 64
+
+    def __init__(self):
+        self.value = 0
+
+    def update(self, data):
+        self.value = crc32c.crc32c(data, self.value)
+
+    def hexdigest(self) -> str:
+        return "%08x" % self.value
+
 class HasherFactory:
+    Sha512 = "sha512"
+    Blake2b = "blake2b"
+    Blake3 = "blake3"
+    Xxh3 = "xxh3"
+    Crc32c = "crc32c"
+    Default = Sha512
+    # fast hashes are fine for grouping but should be verified before deleting anything
+    Strong = [Sha512, Blake2b, Blake3]
+
+    @staticmethod
+    def algorithms() -> list:
+        return [HasherFactory.Xxh3, HasherFactory.Blake2b, HasherFactory.Blake3, HasherFactory.Crc32c, HasherFactory.Sha512]
+
+    @staticmethod
+    def isAvailable(algo: str) -> bool:
+        if algo == HasherFactory.Xxh3:
+            return xxhash is not None
+        if algo == HasherFactory.Blake3:
+            return blake3 is not None
+        if algo == HasherFactory.Crc32c:
+            return crc32c is not None
+        return algo in HasherFactory.algorithms()
+
     @staticmethod
-    def createHasher():
+    def createHasher(algo: str = Default):
+        if not HasherFactory.isAvailable(algo):
+            raise ValueError("hash algorithm %s is not available" % algo)
+        if algo == HasherFactory.Xxh3:
+            return xxhash.xxh3_128()
+        if algo == HasherFactory.Blake2b:
+            return hashlib.blake2b()
+        if algo == HasherFactory.Blake3:
+            return blake3.blake3()
+        if algo == HasherFactory.Crc32c:
+            return Crc32cHasher()
         return hashlib.sha512()
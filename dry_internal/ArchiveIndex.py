@@ -0,0 +1,29 @@
+class ArchiveIndex:
+    # archive digest -> member listing [(member, size, hash)]. a repeated archive costs one hash of the archive and a lookup.
+    # listings of this run are kept in memory, the hash cache (if any) keeps them between runs.
+    # a listing depends on how deep nested archives were opened, so the depth is a part of the key
+    def __init__(self, hashCache, algo: str, depth: int):
+        self.hashCache = hashCache
+        self.algo = algo
+        self.depth = depth
+        self.listings = {}
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, digest: str):
+        members = self.listings.get(digest)
+        if members is None and self.hashCache:
+            members = self.hashCache.lookupArchive(digest, self.algo, self.depth)
+            if members is not None:
+                self.listings[digest] = members
+        if members is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return members
+
+    def store(self, digest: str, members: list):
+        # only complete listings. an archive with unreadable members is read again next time
+        self.listings[digest] = members
+        if self.hashCache:
+            self.hashCache.storeArchive(digest, self.algo, self.depth, members)
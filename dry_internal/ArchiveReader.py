@@ -0,0 +1,201 @@
+import os
+import shutil
+import tarfile
+import zipfile
+import tempfile
+import collections
+
+from . import hasher, ArchiveSniffer
+
+# members of zip and tar archives are hashed straight from the archive stream.
+# other formats are extracted by patool into a private tmp folder that is removed right away.
+# a member that is an archive itself is copied to a spool file in the same pass that hashes it,
+# and is opened later from a work queue, down to maxDepth levels.
+# each call is self-contained, so it runs the same way inline and in a pool worker
+
+def memberName(archiveName: str, member: str) -> str:
+    return "%s:/%s" % (archiveName, member.lstrip("/"))
+
+def countMembers(path: str) -> int:
+    # for the progress totals. only the zip central directory is cheap to list, anything else would be read in full
+    if not zipfile.is_zipfile(path):
+        return 0
+    with zipfile.ZipFile(path) as archive:
+        return sum(1 for info in archive.infolist() if not info.is_dir())
+
+class BudgetExceeded(Exception):
+    pass
+
+class Spooler:
+    # tmp space of one readMembers call: spool files of nested archives waiting in the queue and the folder
+    # of the archive being extracted. together they never take more than budget bytes (0 - no limit)
+    def __init__(self, tmpBase: str, budget: int):
+        self.tmpBase = tmpBase
+        self.budget = budget
+        self.used = 0
+        self.files = {}
+        self.skipped = []
+
+    def open(self, name: str, stream, size: int):
+        # (path, file) to copy the member to, or None if it is not an archive or there is no room for it
+        if ArchiveSniffer.excluded(name) or not ArchiveSniffer.sniffHead(stream.peek(ArchiveSniffer.HeadSize)):
+            return None
+        if not self.fits(size):
+            self.skipped.append(name)
+            return None
+        # the member keeps its name in a private folder: patool goes by the suffix when the content
+        # does not tell the format, and a single compressed file is extracted under its own name
+        path = os.path.join(tempfile.mkdtemp(prefix=".dry", dir=self.tmpBase), os.path.basename(name))
+        self.files[path] = size
+        self.used += size
+        return path, open(path, 'wb')
+
+    def fits(self, size: int) -> bool:
+        return not self.budget or self.used + size <= self.budget
+
+    def reserve(self, size: int):
+        self.used += size
+
+    def free(self, size: int):
+        self.used -= size
+
+    def release(self, path: str):
+        self.used -= self.files.pop(path, 0)
+        shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+
+    def takeSkipped(self) -> list:
+        rc = self.skipped
+        self.skipped = []
+        return rc
+
+def readMember(stream, name: str, size: int, algo: str, spooler) -> tuple:
+    # (hash, size, spool path or None)
+    spool = spooler.open(name, stream, size) if spooler else None
+    if not spool:
+        return hasher.hashStream(stream, algo) + (None,)
+    path, out = spool
+    try:
+        with out:
+            return hasher.hashStream(stream, algo, out) + (path,)
+    except BaseException:
+        spooler.release(path)
+        raise
+
+def readZip(path: str, algo: str, spooler, nest: bool):
+    with zipfile.ZipFile(path) as archive:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            try:
+                with archive.open(info) as member:
+                    hashStr, size, spool = readMember(member, info.filename, info.file_size, algo, spooler if nest else None)
+            except Exception as e:
+                # encrypted or broken member. the rest of the archive is still readable
+                yield info.filename, 0, "", str(e), None
+                continue
+            yield info.filename, size, hashStr, "", spool
+
+def readTar(path: str, algo: str, spooler, nest: bool):
+    # stream mode: compressed tars are read front to back once, no seeks
+    with tarfile.open(path, "r|*") as archive:
+        members = iter(archive)
+        while True:
+            try:
+                info = next(members)
+            except StopIteration:
+                return
+            except Exception as e:
+                # a broken header ends the stream, the members behind it are lost
+                yield "", 0, "", "listing is incomplete: %s" % str(e), None
+                return
+            if not info.isfile():
+                continue
+            try:
+                hashStr, size, spool = readMember(archive.extractfile(info), info.name, info.size, algo, spooler if nest else None)
+            except Exception as e:
+                yield info.name, 0, "", str(e), None
+                continue
+            yield info.name, size, hashStr, "", spool
+
+def folderSize(folder: str) -> int:
+    total = 0
+    for root, _, files in os.walk(folder):
+        for fname in files:
+            try:
+                total += os.lstat(os.path.join(root, fname)).st_size
+            except OSError:
+                pass
+    return total
+
+def readExtracted(path: str, algo: str, tmpBase: str, spooler, nest: bool):
+    import patoolib
+    # the extracted size is not known before, the archive size is the least it takes
+    reserved = os.path.getsize(path)
+    if not spooler.fits(reserved):
+        raise BudgetExceeded("not extracted: %d bytes do not fit the tmp budget" % reserved)
+    spooler.reserve(reserved)
+    tmpFolder = tempfile.mkdtemp(prefix=".dry", dir=tmpBase)
+    try:
+        patoolib.extract_archive(path, outdir=tmpFolder, verbosity=-1, interactive=False)
+        # nested spool files are checked against what the extraction really took
+        extracted = folderSize(tmpFolder)
+        spooler.free(reserved)
+        reserved = extracted
+        spooler.reserve(reserved)
+        if spooler.budget and spooler.used > spooler.budget:
+            raise BudgetExceeded("extracted %d bytes, more than the tmp budget" % extracted)
+        for folder, _, files in os.walk(tmpFolder):
+            for fname in sorted(files):
+                fullPath = os.path.join(folder, fname)
+                if os.path.islink(fullPath) or not os.path.isfile(fullPath):
+                    continue
+                member = os.path.relpath(fullPath, tmpFolder)
+                try:
+                    with open(fullPath, 'rb') as a_file:
+                        hashStr, size, spool = readMember(a_file, member, os.fstat(a_file.fileno()).st_size, algo, spooler if nest else None)
+                except OSError as e:
+                    yield member, 0, "", str(e), None
+                    continue
+                yield member, size, hashStr, "", spool
+    finally:
+        spooler.free(reserved)
+        shutil.rmtree(tmpFolder, ignore_errors=True)
+
+def readArchive(path: str, algo: str, tmpBase: str, spooler, nest: bool = True):
+    # yields (member, size, hash, error, spool path) for one level. nested archives are spooled only with nest
+    if zipfile.is_zipfile(path):
+        return readZip(path, algo, spooler, nest)
+    if tarfile.is_tarfile(path):
+        return readTar(path, algo, spooler, nest)
+    return readExtracted(path, algo, tmpBase, spooler, nest)
+
+def readMembers(path: str, algo: str, tmpBase: str = ".", maxDepth: int = 1, budget: int = 0):
+    # yields (member, size, hash, error) for every regular file in the archive and in the archives inside it.
+    # a nested member is named inner:/member. maxDepth 1 - the archive itself only
+    spooler = Spooler(tmpBase, budget)
+    # (file, member name, depth). depth first, so spool files are released as early as possible
+    jobs = collections.deque([(path, "", 1)])
+    try:
+        while jobs:
+            source, prefix, depth = jobs.popleft()
+            nested = []
+            try:
+                for member, size, hashStr, err, spool in readArchive(source, algo, tmpBase, spooler, depth < maxDepth):
+                    name = memberName(prefix, member) if prefix else member
+                    if spool:
+                        nested.append((spool, name, depth + 1))
+                    yield name, size, hashStr, err
+            except Exception as e:
+                if not prefix:
+                    raise
+                # the nested archive was already hashed as a member, only its contents are missing
+                yield prefix, 0, "", "cannot read nested archive: %s" % str(e)
+            finally:
+                jobs.extendleft(reversed(nested))
+                if prefix:
+                    spooler.release(source)
+            for member in spooler.takeSkipped():
+                yield memberName(prefix, member) if prefix else member, 0, "", "nested archive is not opened: tmp budget exceeded"
+    finally:
+        for source, prefix, _ in jobs:
+            spooler.release(source)
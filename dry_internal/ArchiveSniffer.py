@@ -0,0 +1,151 @@
+import struct
+import functools
+from pathlib import PurePath
+
+# magic bytes of the formats patool can open. one read of the file head replaces
+# patoolib.get_archive_format, which runs the `file` program for every path it is asked about
+
+HeadSize = 512
+IsoOffset = 32769
+
+# containers that are better compared as whole files
+Exclusions = [".epub", "epub", "chm", ".chm", ".cd", ".CD", ".ova", ".vmdk", ".mp4", ".deb", ".rpm", ".img",
+              ".docx", ".docm", ".dotx", ".xlsx", ".xlsm", ".xltx", ".pptx", ".pptm", ".potx", ".vsdx",
+              ".odt", ".ods", ".odp", ".odg", ".odf", ".ott", ".ots", ".otp",
+              ".jar", ".war", ".ear", ".apk", ".aab", ".xpi", ".kmz", ".3mf", ".whl"]
+
+# first entries of zip based document formats (odf, ooxml), whatever the suffix
+ZipDocuments = [b"mimetype", b"[Content_Types].xml"]
+
+# (offset, magic, format)
+Signatures = [
+    (0, b"PK\x03\x04", "zip"),
+    (0, b"PK\x05\x06", "zip"),
+    (0, b"PK\x07\x08", "zip"),
+    (0, b"\x1f\x8b", "gzip"),
+    (0, b"BZh", "bzip2"),
+    (0, b"\xfd7zXZ\x00", "xz"),
+    (0, b"\x5d\x00\x00", "lzma"),
+    (0, b"7z\xbc\xaf\x27\x1c", "7z"),
+    (0, b"Rar!\x1a\x07", "rar"),
+    (0, b"MSCF", "cab"),
+    (0, b"ITSF", "chm"),
+    (0, b"\x60\xea", "arj"),
+    (0, b"!<arch>\ndebian-binary", "deb"),
+    (0, b"!<arch>\n", "ar"),
+    (0, b"070701", "cpio"),
+    (0, b"070702", "cpio"),
+    (0, b"070707", "cpio"),
+    (0, b"\xc7\x71", "cpio"),
+    (0, b"\x71\xc7", "cpio"),
+    (0, b"\xed\xab\xee\xdb", "rpm"),
+    (0, b"LZIP", "lzip"),
+    (0, b"\x1f\x9d", "compress"),
+    (0, b"\x89LZO\x00\r\n\x1a\n", "lzop"),
+    (0, b"LRZI", "lrzip"),
+    (0, b"RZIP", "rzip"),
+    (0, b"7kSt", "zpaq"),
+    (0, b"zPQ", "zpaq"),
+    (0, b"DMS!", "dms"),
+    (0, b"ALZ\x01", "alzip"),
+    (0, b"ZOO ", "zoo"),
+    (2, b"-lh", "lzh"),
+    (2, b"-lz", "lzh"),
+    (7, b"**ACE**", "ace"),
+]
+
+# two or three byte magics turn up in plain data, the header behind them is checked as well
+def isPlainZip(head: bytes) -> bool:
+    # the name of the first local header
+    if len(head) < 30:
+        return False
+    nameLen, = struct.unpack_from("<H", head, 26)
+    return head[30:30 + nameLen] not in ZipDocuments
+
+def isArjHeader(head: bytes) -> bool:
+    # basic header size, the main header is a comment header (file type 2)
+    if len(head) < 11:
+        return False
+    size = struct.unpack_from("<H", head, 2)[0]
+    return 0 < size <= 2600 and head[4] <= size and head[10] == 2
+
+def isCompressHeader(head: bytes) -> bool:
+    # flags: max code bits 9..16, bits 5 and 6 unused
+    if len(head) < 3:
+        return False
+    return head[2] & 0x60 == 0 and 9 <= head[2] & 0x1f <= 16
+
+CpioTypes = {0o010000, 0o020000, 0o040000, 0o060000, 0o100000, 0o120000, 0o140000}
+
+def isCpioHeader(head: bytes) -> bool:
+    # old binary header: a known file type and a zero terminated name right after the 26 bytes
+    if len(head) < 26:
+        return False
+    order = "<" if head[0] == 0xc7 else ">"
+    mode, = struct.unpack_from(order + "H", head, 6)
+    namesize, = struct.unpack_from(order + "H", head, 20)
+    if mode & 0o170000 not in CpioTypes or namesize == 0:
+        return False
+    if 26 + namesize > len(head):
+        return namesize <= 4096
+    return head[25 + namesize] == 0
+
+def isLzmaHeader(head: bytes) -> bool:
+    # lzma_alone: dictionary 2^n or 2^n + 2^(n-1), uncompressed size unknown (-1) or below 256 GB as xz does
+    if len(head) < 13:
+        return False
+    dictSize, = struct.unpack_from("<I", head, 1)
+    size, = struct.unpack_from("<Q", head, 5)
+    if dictSize < 4096:
+        return False
+    top = 1 << (dictSize.bit_length() - 1)
+    if dictSize not in (top, top | top >> 1):
+        return False
+    return size == 0xffffffffffffffff or size < 1 << 38
+
+Checks = {
+    b"PK\x03\x04": isPlainZip,
+    b"\x60\xea": isArjHeader,
+    b"\x1f\x9d": isCompressHeader,
+    b"\xc7\x71": isCpioHeader,
+    b"\x71\xc7": isCpioHeader,
+    b"\x5d\x00\x00": isLzmaHeader,
+}
+
+def isTarHeader(head: bytes) -> bool:
+    # old v7 tars have no magic, the header checksum tells them apart. ustar ones pass it as well
+    if len(head) < 512:
+        return False
+    try:
+        chksum = int(head[148:156].split(b"\0", 1)[0].strip(), 8)
+    except ValueError:
+        return False
+    return chksum == sum(head[:148]) + 8 * 32 + sum(head[156:512])
+
+def excluded(name: str) -> bool:
+    return PurePath(name).suffix.lower() in Exclusions
+
+def sniffHead(head: bytes):
+    # archive format by the first HeadSize bytes or None
+    for offset, magic, fmt in Signatures:
+        if head.startswith(magic, offset) and (magic not in Checks or Checks[magic](head)):
+            return fmt
+    if isTarHeader(head):
+        return "tar"
+    return None
+
+@functools.lru_cache(maxsize=4096)
+def sniff(path: str):
+    # archive format of the file or None. iso images keep their descriptor 32 KB in, only *.iso files are read that far
+    try:
+        with open(path, 'rb', buffering=0) as a_file:
+            fmt = sniffHead(a_file.read(HeadSize))
+            if fmt:
+                return fmt
+            if path.lower().endswith(".iso"):
+                a_file.seek(IsoOffset)
+                if a_file.read(5) == b"CD001":
+                    return "iso"
+    except OSError:
+        pass
+    return None
@@ -1,16 +1,21 @@
 import sqlite3
 import os
+import time
+execute_values = None
 try:
     import psycopg as pg
     print("db engine is psycopg 3")
 except ImportError:
     try:
         import psycopg2 as pg
+        from psycopg2.extras import execute_values
         print("db engine is psycopg 2")
     except ImportError:
         # Fall back to psycopg2cffi
         from psycopg2cffi import compat
         compat.register()
+        import psycopg2 as pg
+        from psycopg2.extras import execute_values
         print("db engine is psycopg2cffi")
 
 class DbLogLevel:
@@ -22,36 +27,178 @@ class DbLogLevel:
 class DBEngine:
     StorageSqlite = "sqlite"
     StoragePG = "pg"
+    StorageMemory = "memory"
+    # rows written with another algorithm are never compared with the current ones
+    HashAlgo = "sha512"
+    # writes are buffered and committed in one transaction per flush
+    FlushRows = 1000
+    FlushInterval = 2.0
+
+    @staticmethod
+    def setHashAlgo(algo: str):
+        DBEngine.HashAlgo = algo
+
+    @staticmethod
+    def setFlushPolicy(rows: int, interval: float):
+        DBEngine.FlushRows = rows
+        DBEngine.FlushInterval = interval
+
+    def __init__(self):
+        self.pendingFiles = []
+        self.pendingGroups = []
+        self.pendingLog = []
+        self.pendingLinks = []
+        self.lastFlush = time.monotonic()
+        # rows the storage refused. they are missing from the report
+        self.droppedRows = 0
 
     def open(self, path: str):
         pass
     def checkDb(self):
         pass
+    def keep_online(self):
+        pass
     def makeDb(self):
         pass
     def notUniqueHashes(self):
         pass
     def filesByHash(self, hash_str: str):
         pass
-    def writeFileInfo(self, path: str, hash_str: str, size: int):
+    def duplicatesCount(self) -> int:
         pass
-    def writeGroupRecord(self, hash_str: str, fname: str, size: int):
+    def duplicateFiles(self):
+        # (groupId, path, size) of every not unique (hash, size), ordered by hash, size and path.
+        # files of one hash and different sizes are a collision: each size is a group of its own, named hash.size
+        pass
+    def storeDuplicateGroups(self):
+        # reduce stage without verification. results are filled by the db itself
         pass
+    def storeLinkGroups(self):
+        # paths sharing one inode go to results as their own groups
+        pass
+    def groupedFiles(self):
+        # (groupId, path, size) from results, ordered by groupId and path
+        pass
+    def groupedFilesBySize(self):
+        # same rows, largest groups (size * count) first
+        pass
+    def clearResults(self):
+        pass
+    def hashedPaths(self) -> set:
+        # paths already indexed in this session. used to resume an interrupted run
+        return set()
+    def writeCheckpoint(self, key: str, value: str):
+        pass
+    def readCheckpoint(self, key: str):
+        return None
     def close(self):
         pass
     def cleanup(self):
         pass
-    def writeLog(self, td: int, level: str, msg: str):
+    def commitBatch(self, files: list, groups: list, log: list, links: list):
         pass
 
+    def writeFileInfo(self, path: str, hash_str: str, size: int):
+        self.pendingFiles.append((path, hash_str, size))
+        self.flushIfNeeded()
+
+    def writeFileInfoBatch(self, rows: list):
+        self.pendingFiles.extend(rows)
+        self.flushIfNeeded()
+
+    def writeGroupRecord(self, hash_str: str, fname: str, size: int):
+        self.pendingGroups.append((hash_str, fname, size))
+        self.flushIfNeeded()
+
+    def writeLog(self, td: int, level: str, msg: str):
+        self.pendingLog.append((td, level, msg))
+        self.flushIfNeeded()
+
+    def writeLinkRecord(self, groupId: str, path: str, size: int):
+        self.pendingLinks.append((groupId, path, size))
+        self.flushIfNeeded()
+
+    def pendingCount(self) -> int:
+        return len(self.pendingFiles) + len(self.pendingGroups) + len(self.pendingLog) + len(self.pendingLinks)
+
+    def flushIfNeeded(self):
+        if self.pendingCount() >= DBEngine.FlushRows or (time.monotonic() - self.lastFlush) >= DBEngine.FlushInterval:
+            self.flush()
+
+    def flush(self):
+        files, groups, log, links = self.pendingFiles, self.pendingGroups, self.pendingLog, self.pendingLinks
+        self.pendingFiles, self.pendingGroups, self.pendingLog, self.pendingLinks = [], [], [], []
+        self.lastFlush = time.monotonic()
+        if files or groups or log or links:
+            self.commitBatch(files, groups, log, links)
+
 class PgPath:
     def __init__(self) -> None:
         self.host = ""
+        self.port = 5432
         self.user = ""
         self.password = ""
         self.dbname = ""
     def filled(self)->bool:
         return bool(self.host) and bool(self.user) and bool(self.dbname)
+    def key(self) -> tuple:
+        return (self.host, int(self.port), self.user, self.dbname)
+
+Psycopg3 = pg.__name__ == "psycopg"
+
+def isClosed(connection) -> bool:
+    # no round trip. psycopg 2 reports a number, psycopg 3 a bool
+    return connection is None or bool(connection.closed)
+
+class PgPool:
+    # idle connections of this process by server and database. an engine takes one on open and gives it back on close.
+    # connections inherited through fork belong to the parent and are dropped without closing them
+    MaxIdle = 4
+    idle = {}
+    pid = os.getpid()
+
+    @staticmethod
+    def acquire(path: PgPath):
+        if PgPool.pid != os.getpid():
+            PgPool.idle = {}
+            PgPool.pid = os.getpid()
+        connections = PgPool.idle.get(path.key(), [])
+        while connections:
+            connection = connections.pop()
+            if not isClosed(connection):
+                return connection
+        connection = pg.connect(dbname=path.dbname, user=path.user, password=path.password, host=path.host, port=str(path.port), connect_timeout=5)
+        if not connection:
+            raise ConnectionError("cannot connect to %s:%s/%s" % (path.host, path.port, path.dbname))
+        return connection
+
+    @staticmethod
+    def release(path: PgPath, connection):
+        if isClosed(connection):
+            return
+        if PgPool.pid != os.getpid():
+            return
+        connections = PgPool.idle.setdefault(path.key(), [])
+        if len(connections) >= PgPool.MaxIdle:
+            connection.close()
+            return
+        try:
+            connection.rollback()
+            if not Psycopg3:
+                # names prepared by the previous owner
+                connection.cursor().execute("DEALLOCATE ALL")
+                connection.commit()
+        except pg.Error:
+            connection.close()
+            return
+        connections.append(connection)
+
+    @staticmethod
+    def discard(connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
 
 class PGEngine(DBEngine):
     ProduccerId = None
@@ -63,52 +210,86 @@ class PGEngine(DBEngine):
         PGEngine.ProduccerId = produccer
         PGEngine.SessionId = session
 
+    # failures of the connection itself. the statement is retried once on a new connection
+    ConnectionErrors = (pg.OperationalError, pg.InterfaceError)
+    # (groupId, path, size) of duplicates. window functions run after WHERE, so the size range covers duplicates only
+    GroupsQuery = """
+        SELECT CASE WHEN MIN(size) OVER same = MAX(size) OVER same THEN hash ELSE hash || '.' || size END AS groupId, hash, path, size FROM
+            (SELECT hash, path, size, COUNT(*) OVER (PARTITION BY hash, size) AS copies FROM public.hashes WHERE session_id=%s AND algo=%s) h
+        WHERE copies > 1
+        WINDOW same AS (PARTITION BY hash)
+    """
+
     def __init__(self):
+        super().__init__()
         self.connection = None
         self.cursor = None
         self.path = ""
+        self.prepared = set()
+        self.registered = False
 
     def is_opened(self) -> bool:
-        try:
-            cur = self.connection.cursor()
-            cur.execute('SELECT 1')
-            return True
-        except pg.OperationalError:
-            return False
-        except Exception as e:
-            print(f"unexpected exception when db check {e}")
-        return False
+        return not isClosed(self.connection)
 
     def keep_online(self):
+        # the connection is not pinged before use, a statement that fails on a broken connection reconnects
         if self.is_opened():
             return
-        self.close()
-        self.open(self.path)
+        self.reconnect()
+
+    def reconnect(self):
+        if self.connection:
+            PgPool.discard(self.connection)
+        self.connection = PgPool.acquire(self.path)
+        self.cursor = self.connection.cursor()
+        self.prepared = set()
 
     def open(self, path: PgPath):
         if not path.filled():
             raise ValueError("Invalig pgconfig")
         self.path = path
-        self.connection = pg.connect(dbname=path.dbname, user=path.user, password=path.password, host=path.host, port="5432", connect_timeout=5)
-        if not self.connection:
-            raise ConnectionError("cannot connect to %s:%s" % (path.host, path.dbname))
+        self.connection = PgPool.acquire(path)
         self.cursor = self.connection.cursor()
+        self.prepared = set()
         self.makeDb()
 
     def close(self):
+        if self.connection:
+            self.flush()
         self.cursor = None
         if self.connection:
-            self.connection.close()
+            PgPool.release(self.path, self.connection)
         self.connection = None
 
-    def execOne(self, q, args):
+    def execOne(self, q, args, name: str = None):
+        # named statements are prepared once per connection
         self.checkDb()
-        self.keep_online()
-        try:
-            self.cursor.execute(q, args)
-        except Exception as e:
-            print(e, " in ", q)
-
+        for attempt in range(2):
+            try:
+                if name:
+                    self.execPrepared(name, q, args)
+                else:
+                    self.cursor.execute(q, args)
+                return
+            except PGEngine.ConnectionErrors as e:
+                if attempt:
+                    print(e, " in ", q)
+                    return
+                self.reconnect()
+            except Exception as e:
+                print(e, " in ", q)
+                return
+
+    def execPrepared(self, name: str, q: str, args):
+        if Psycopg3:
+            # psycopg 3 prepares by itself
+            self.cursor.execute(q, args, prepare=True)
+            return
+        if name not in self.prepared:
+            parts = q.split("%s")
+            self.cursor.execute("PREPARE %s AS %s" % (name, "".join(part + ("$%d" % i if i < len(parts) else "") for i, part in enumerate(parts, 1))))
+            self.prepared.add(name)
+        self.cursor.execute("EXECUTE %s (%s)" % (name, ", ".join(["%s"] * len(args))), args)
 
     def checkDb(self):
         if not self.cursor or not self.connection:
@@ -133,9 +314,11 @@ class PGEngine(DBEngine):
                     hash character varying(256) COLLATE pg_catalog."default" NOT NULL,
                     size bigint NOT NULL,
                     frags jsonb,
+                    algo character varying(16) NOT NULL DEFAULT 'sha512',
                     CONSTRAINT hashes_pkey PRIMARY KEY (id)
                 )
             """)
+            self.cursor.execute("ALTER TABLE IF EXISTS public.hashes ADD COLUMN IF NOT EXISTS algo character varying(16) NOT NULL DEFAULT 'sha512';")
             self.cursor.execute("ALTER TABLE IF EXISTS public.hashes OWNER TO %s;" % self.path.user)
             self.cursor.execute("""
                 CREATE TABLE IF NOT EXISTS public.results
@@ -163,8 +346,55 @@ class PGEngine(DBEngine):
                 );
             """)
             self.cursor.execute("ALTER TABLE IF EXISTS public.log OWNER TO %s;" % self.path.user)
-            self.cursor.execute("CREATE OR REPLACE VIEW public.sessions AS SELECT DISTINCT session_id as sid FROM public.hashes order by session_id;")
-            self.cursor.execute("ALTER TABLE public.sessions OWNER TO %s;" % self.path.user)
+            self.cursor.execute("""
+                CREATE TABLE IF NOT EXISTS public.checkpoints
+                (
+                    session_id bigint NOT NULL,
+                    key character varying(64) NOT NULL,
+                    value text,
+                    PRIMARY KEY (session_id, key)
+                );
+            """)
+            self.cursor.execute("ALTER TABLE IF EXISTS public.checkpoints OWNER TO %s;" % self.path.user)
+            self.cursor.execute("""
+                CREATE TABLE IF NOT EXISTS public.links
+                (
+                    id bigserial NOT NULL,
+                    session_id bigint NOT NULL,
+                    groupId character varying(256) NOT NULL,
+                    path character varying(512) NOT NULL,
+                    size bigint NOT NULL,
+                    PRIMARY KEY (id)
+                );
+            """)
+            self.cursor.execute("ALTER TABLE IF EXISTS public.links OWNER TO %s;" % self.path.user)
+            # sessions used to be a view over hashes. a session is registered by its first batch and finished by cleanup
+            self.cursor.execute("""
+                DO $$ BEGIN
+                    IF EXISTS (SELECT 1 FROM pg_views WHERE schemaname = 'public' AND viewname = 'sessions') THEN
+                        DROP VIEW public.sessions;
+                    END IF;
+                    IF to_regclass('public.sessions') IS NULL THEN
+                        CREATE TABLE public.sessions
+                        (
+                            sid bigint NOT NULL,
+                            algo character varying(16) NOT NULL DEFAULT 'sha512',
+                            started timestamp with time zone NOT NULL DEFAULT now(),
+                            finished timestamp with time zone,
+                            PRIMARY KEY (sid)
+                        );
+                        -- hashes of finished sessions are deleted, what is left is unfinished
+                        INSERT INTO public.sessions(sid) SELECT DISTINCT session_id FROM public.hashes;
+                    END IF;
+                END $$;
+            """)
+            self.cursor.execute("ALTER TABLE IF EXISTS public.sessions OWNER TO %s;" % self.path.user)
+            # every query is scoped to one session. the session leads each index, the rest of a row is in the index too,
+            # so the reduce reads one range of the index in hash order and never touches other sessions or the heap
+            self.cursor.execute("DROP INDEX IF EXISTS public.hashes_session_i;")
+            self.cursor.execute("CREATE INDEX IF NOT EXISTS hashes_group_i ON public.hashes (session_id, algo, hash, size, path);")
+            self.cursor.execute('CREATE INDEX IF NOT EXISTS results_session_i ON public.results (session_id, groupId COLLATE "C", path) INCLUDE (size);')
+            self.cursor.execute("CREATE INDEX IF NOT EXISTS links_session_i ON public.links (session_id, groupId, path) INCLUDE (size);")
 
         except Exception as e:
             print(e, " in ",self.cursor.query)
@@ -175,9 +405,10 @@ class PGEngine(DBEngine):
 
     def lastSession(self):
         self.checkDb()
+        self.flush()
         session = None
         try:
-            self.cursor.execute("SELECT MAX(session_id)FROM public.hashes")
+            self.cursor.execute("SELECT MAX(sid) FROM public.sessions WHERE finished IS NULL")
             qrc = self.cursor.fetchone()
             if qrc:
                 session = qrc[0]
@@ -185,11 +416,21 @@ class PGEngine(DBEngine):
             session = None
         return session
 
+    def sessionAlgos(self) -> set:
+        # hash algorithms of the session rows, or the one it was registered with if there are no rows yet
+        self.checkDb()
+        self.execOne("SELECT DISTINCT algo FROM public.hashes WHERE session_id=%s", (PGEngine.SessionId,))
+        algos = set(row[0] for row in self.cursor.fetchall())
+        if not algos:
+            self.execOne("SELECT algo FROM public.sessions WHERE sid=%s", (PGEngine.SessionId,))
+            algos = set(row[0] for row in self.cursor.fetchall())
+        return algos
+
     def notUniqueHashes(self):
         self.checkDb()
-        self.keep_online()
+        self.flush()
         rc = []
-        self.execOne("SELECT DISTINCT hash FROM public.hashes WHERE session_id=%s GROUP BY hash HAVING COUNT(*) > 1", (PGEngine.SessionId,))
+        self.execOne("SELECT DISTINCT hash FROM public.hashes WHERE session_id=%s AND algo=%s GROUP BY hash, size HAVING COUNT(*) > 1", (PGEngine.SessionId, DBEngine.HashAlgo))
         try:
             qrc = self.cursor.fetchall()
         except pg.ProgrammingError:
@@ -200,9 +441,9 @@ class PGEngine(DBEngine):
 
     def filesByHash(self, hash_str: str):
         self.checkDb()
-        self.keep_online()
+        self.flush()
         rc = []
-        self.execOne("SELECT path, size FROM public.hashes  WHERE hash=%s and session_id=%s", (hash_str,PGEngine.SessionId))
+        self.execOne("SELECT path, size FROM public.hashes  WHERE hash=%s and session_id=%s and algo=%s", (hash_str, PGEngine.SessionId, DBEngine.HashAlgo), "dry_files_by_hash")
         try:
             qrc = self.cursor.fetchall()
         except pg.ProgrammingError:
@@ -210,24 +451,198 @@ class PGEngine(DBEngine):
         for row in qrc:
             rc.append((row[0], row[1]))
         return rc
-    def writeFileInfo(self, path: str, hash_str: str, size: int):
-        self.execOne("INSERT INTO public.hashes(producer_id, path, hash, size, session_id) VALUES (%s, %s, %s, %s, %s)", (PGEngine.ProduccerId, path, hash_str, size, PGEngine.SessionId))
+    def streamQuery(self, q, args):
+        self.checkDb()
+        self.flush()
+        self.keep_online()
+        # server-side cursor. withhold keeps it alive across commits of buffered writes
+        cursor = self.connection.cursor(name="dry_stream", withhold=True)
+        cursor.itersize = 10000
+        try:
+            cursor.execute(q, args)
+            for row in cursor:
+                yield row
+        finally:
+            cursor.close()
+
+    def duplicatesCount(self) -> int:
+        self.checkDb()
+        self.flush()
+        self.execOne("SELECT COUNT(*) FROM (SELECT hash FROM public.hashes WHERE session_id=%s AND algo=%s GROUP BY hash, size HAVING COUNT(*) > 1) AS dups", (PGEngine.SessionId, DBEngine.HashAlgo))
+        qrc = self.cursor.fetchone()
+        return qrc[0] if qrc else 0
+
+    def duplicateFiles(self):
+        # one pass over the index: rows come in hash and size order, the windows count each group
+        return self.streamQuery(PGEngine.GroupsQuery + " ORDER BY hash, size, path", (PGEngine.SessionId, DBEngine.HashAlgo))
+
+    def storeDuplicateGroups(self):
+        self.checkDb()
+        self.flush()
+        self.execOne("""
+            INSERT INTO public.results(session_id, groupId, path, size)
+            SELECT %s, groupId, path, size FROM (""" + PGEngine.GroupsQuery + """) g
+        """, (PGEngine.SessionId, PGEngine.SessionId, DBEngine.HashAlgo))
         self.connection.commit()
 
-    def writeGroupRecord(self, hash_str: str, fname: str, size: int):
-        self.execOne("INSERT INTO public.results(session_id, groupId, path, size) VALUES (%s, %s, %s, %s)", (PGEngine.SessionId, hash_str, fname, size))
+    def storeLinkGroups(self):
+        self.checkDb()
+        self.flush()
+        # a resumed session may record the same link twice
+        self.execOne("""
+            INSERT INTO public.results(session_id, groupId, path, size)
+            SELECT DISTINCT session_id, groupId, path, size FROM public.links
+            WHERE session_id=%s AND groupId IN
+                (SELECT groupId FROM public.links WHERE session_id=%s GROUP BY groupId HAVING COUNT(DISTINCT path) > 1)
+        """, (PGEngine.SessionId, PGEngine.SessionId))
         self.connection.commit()
 
-    def writeLog(self, td: int, level: str, msg: str):
-        self.execOne("INSERT INTO public.log(td, sid, pid, level, message) VALUES (%s, %s, %s, %s, %s)", (td, PGEngine.SessionId, os.getpid(), level, msg))
+    def groupedFiles(self):
+        return self.streamQuery('SELECT groupId, path, size FROM public.results WHERE session_id=%s ORDER BY groupId COLLATE "C", path', (PGEngine.SessionId,))
+
+    def groupedFilesBySize(self):
+        return self.streamQuery("""
+            SELECT groupId, path, size FROM
+                (SELECT groupId, path, size, COUNT(*) OVER (PARTITION BY groupId) AS cnt FROM public.results WHERE session_id=%s) r
+            ORDER BY size * cnt DESC, groupId COLLATE "C", path
+        """, (PGEngine.SessionId,))
+
+    def clearResults(self):
+        self.checkDb()
+        self.flush()
+        self.execOne("DELETE FROM public.results WHERE session_id = %s", (PGEngine.SessionId,))
+        self.connection.commit()
+
+    def hashedPaths(self) -> set:
+        return set(row[0] for row in self.streamQuery("SELECT path FROM public.hashes WHERE session_id=%s AND algo=%s", (PGEngine.SessionId, DBEngine.HashAlgo)))
+
+    def writeCheckpoint(self, key: str, value: str):
+        self.checkDb()
+        # everything written before the checkpoint must be durable too
+        self.flush()
+        self.execOne("""
+            INSERT INTO public.checkpoints(session_id, key, value) VALUES (%s, %s, %s)
+            ON CONFLICT (session_id, key) DO UPDATE SET value = EXCLUDED.value
+        """, (PGEngine.SessionId, key, str(value)), "dry_write_checkpoint")
         self.connection.commit()
 
+    def readCheckpoint(self, key: str):
+        self.checkDb()
+        self.execOne("SELECT value FROM public.checkpoints WHERE session_id=%s AND key=%s", (PGEngine.SessionId, key), "dry_read_checkpoint")
+        try:
+            qrc = self.cursor.fetchone()
+        except pg.ProgrammingError:
+            qrc = None
+        return qrc[0] if qrc else None
+
+    def bulkInsert(self, table: str, columns: str, rows: list):
+        if not rows:
+            return
+        if Psycopg3:
+            with self.cursor.copy("COPY %s (%s) FROM STDIN" % (table, columns)) as copy:
+                for row in rows:
+                    copy.write_row(row)
+        else:
+            # psycopg 2 and psycopg2cffi both ship execute_values
+            execute_values(self.cursor, "INSERT INTO %s(%s) VALUES %%s" % (table, columns), rows)
+
+    def batchTables(self, files: list, groups: list, log: list, links: list) -> list:
+        pid = os.getpid()
+        return [
+            ("public.hashes", "producer_id, path, hash, size, session_id, algo",
+                [(PGEngine.ProduccerId, path, hash_str, size, PGEngine.SessionId, DBEngine.HashAlgo) for path, hash_str, size in files]),
+            ("public.results", "session_id, groupId, path, size",
+                [(PGEngine.SessionId, hash_str, fname, size) for hash_str, fname, size in groups]),
+            ("public.log", "td, sid, pid, level, message",
+                [(td, PGEngine.SessionId, pid, level, msg) for td, level, msg in log]),
+            ("public.links", "session_id, groupId, path, size",
+                [(PGEngine.SessionId, groupId, path, size) for groupId, path, size in links]),
+        ]
+
+    def registerSession(self):
+        if not self.registered:
+            self.cursor.execute("INSERT INTO public.sessions(sid, algo) VALUES (%s, %s) ON CONFLICT DO NOTHING", (PGEngine.SessionId, DBEngine.HashAlgo))
+
+    def commitBatch(self, files: list, groups: list, log: list, links: list):
+        self.checkDb()
+        tables = self.batchTables(files, groups, log, links)
+        for attempt in range(2):
+            try:
+                self.registerSession()
+                for table, columns, rows in tables:
+                    self.bulkInsert(table, columns, rows)
+                self.connection.commit()
+                self.registered = True
+                return
+            except PGEngine.ConnectionErrors as e:
+                # nothing of the batch was committed, it goes again on a new connection
+                if attempt:
+                    print(e, " in batch of %d rows" % sum(len(rows) for _, _, rows in tables))
+                    self.droppedRows += len(files) + len(groups) + len(links)
+                    return
+                self.reconnect()
+            except Exception as e:
+                # a bad row (too long, not encodable) fails the whole batch. the rest of it is stored without it
+                print(e, " in batch of %d rows, storing it in parts" % sum(len(rows) for _, _, rows in tables))
+                self.storeApart(tables)
+                return
+
+    def storeApart(self, tables: list):
+        try:
+            self.connection.rollback()
+            self.registerSession()
+            self.connection.commit()
+            self.registered = True
+        except PGEngine.ConnectionErrors:
+            # the session is registered by the next batch, storeRows reconnects on its own
+            self.reconnect()
+        for table, columns, rows in tables:
+            self.storeRows(table, columns, rows)
+
+    def storeRows(self, table: str, columns: str, rows: list, retry: bool = True):
+        # halves are committed on their own until a failing row is alone, then it is dropped
+        if not rows:
+            return
+        try:
+            self.bulkInsert(table, columns, rows)
+            self.connection.commit()
+        except PGEngine.ConnectionErrors as e:
+            # other parts may be committed already, only this one goes again
+            if retry:
+                self.reconnect()
+                self.storeRows(table, columns, rows, False)
+                return
+            print(e, " in %s, %d rows dropped" % (table, len(rows)))
+            if table != "public.log":
+                self.droppedRows += len(rows)
+        except Exception as e:
+            self.connection.rollback()
+            if len(rows) == 1:
+                print(e, " in %s, row dropped: %s" % (table, rows[0]))
+                if table != "public.log":
+                    self.droppedRows += 1
+                return
+            half = len(rows) // 2
+            self.storeRows(table, columns, rows[:half])
+            self.storeRows(table, columns, rows[half:])
+
     def cleanup(self):
+        self.flush()
         self.execOne("DELETE FROM public.hashes WHERE session_id = %s", (PGEngine.SessionId,))
+        self.execOne("DELETE FROM public.links WHERE session_id = %s", (PGEngine.SessionId,))
+        self.execOne("UPDATE public.sessions SET finished = now() WHERE sid = %s", (PGEngine.SessionId,))
         self.connection.commit()
 
 class SqliteEngine(DBEngine):
+    # same groups as PGEngine.GroupsQuery
+    GroupsQuery = """
+        SELECT CASE WHEN MIN(size) OVER same = MAX(size) OVER same THEN hash ELSE hash || '.' || size END AS groupId, hash, path, size FROM files
+        WHERE algo=? AND (hash, size) IN (SELECT hash, size FROM files WHERE algo=? GROUP BY hash, size HAVING COUNT(*) > 1)
+        WINDOW same AS (PARTITION BY hash)
+    """
+
     def __init__(self):
+        super().__init__()
         self.connection = None
         self.cursor = None
         self.path = ""
@@ -244,23 +659,40 @@ class SqliteEngine(DBEngine):
 
     def makeDb(self):
         self.checkDb()
+        # reopened as is when a session is resumed
         self.cursor.execute("""
-            CREATE TABLE 'files' (
+            CREATE TABLE IF NOT EXISTS 'files' (
                 'path' TEXT NOT NULL UNIQUE,
                 'hash'  TEXT NOT NULL,
-                'size' INTEGER NOT NULL);
+                'size' INTEGER NOT NULL,
+                'algo' TEXT NOT NULL DEFAULT 'sha512');
         """)
         self.cursor.execute("""
-            CREATE TABLE 'result' (
+            CREATE TABLE IF NOT EXISTS 'result' (
             'groupId' TEXT NOT NULL,
             'path'  TEXT NOT NULL,
             'size'  INTEGER NOT NULL);
         """)
+        self.cursor.execute("""
+            CREATE TABLE IF NOT EXISTS 'checkpoint' (
+            'key' TEXT NOT NULL PRIMARY KEY,
+            'value'  TEXT);
+        """)
+        self.cursor.execute("""
+            CREATE TABLE IF NOT EXISTS 'links' (
+            'groupId' TEXT NOT NULL,
+            'path'  TEXT NOT NULL UNIQUE,
+            'size'  INTEGER NOT NULL);
+        """)
 
-        self.cursor.execute("""CREATE INDEX 'hash_i' ON 'files' ('hash');""")
+        self.cursor.execute("""DROP INDEX IF EXISTS 'hash_i';""")
+        self.cursor.execute("""CREATE INDEX IF NOT EXISTS 'hash_size_i' ON 'files' ('hash', 'size');""")
+        self.cursor.execute("""CREATE INDEX IF NOT EXISTS 'group_i' ON 'result' ('groupId');""")
         self.connection.commit()
 
     def close(self):
+        if self.connection:
+            self.flush()
         self.cursor = None
         if self.connection:
             self.connection.close()
@@ -268,35 +700,190 @@ class SqliteEngine(DBEngine):
 
     def notUniqueHashes(self):
         self.checkDb()
-        self.keep_online()
+        self.flush()
         rc = []
-        for row in self.cursor.execute("SELECT DISTINCT hash FROM files GROUP BY hash HAVING COUNT(*) > 1"):
+        for row in self.cursor.execute("SELECT DISTINCT hash FROM files WHERE algo=? GROUP BY hash, size HAVING COUNT(*) > 1", (DBEngine.HashAlgo,)):
             rc.append(row[0])
         return rc
 
     def filesByHash(self, hash_str: str):
         self.checkDb()
-        self.keep_online()
+        self.flush()
         rc = []
-        for row in self.cursor.execute("SELECT path, size FROM files  WHERE hash='" + hash_str + "';"):
+        for row in self.cursor.execute("SELECT path, size FROM files  WHERE hash=? AND algo=?", (hash_str, DBEngine.HashAlgo)):
             rc.append((row[0], row[1]))
         return rc
 
-    def writeFileInfo(self, path: str, hash_str: str, size: int):
+    def streamQuery(self, q, args):
         self.checkDb()
-        self.keep_online()
-        self.cursor.execute("INSERT INTO files VALUES (?,?,?)", (path, hash_str, size))
+        self.flush()
+        # own cursor, self.cursor is used by buffered writes while the caller iterates
+        return self.connection.cursor().execute(q, args)
+
+    def duplicatesCount(self) -> int:
+        self.checkDb()
+        self.flush()
+        row = self.cursor.execute("SELECT COUNT(*) FROM (SELECT hash FROM files WHERE algo=? GROUP BY hash, size HAVING COUNT(*) > 1)", (DBEngine.HashAlgo,)).fetchone()
+        return row[0] if row else 0
+
+    def duplicateFiles(self):
+        return self.streamQuery("SELECT groupId, path, size FROM (" + SqliteEngine.GroupsQuery + ") ORDER BY hash, size, path", (DBEngine.HashAlgo, DBEngine.HashAlgo))
+
+    def storeDuplicateGroups(self):
+        self.checkDb()
+        self.flush()
+        self.cursor.execute("INSERT INTO result SELECT groupId, path, size FROM (" + SqliteEngine.GroupsQuery + ")", (DBEngine.HashAlgo, DBEngine.HashAlgo))
         self.connection.commit()
 
-    def writeGroupRecord(self, hash_str: str, fname: str, size: int):
+    def storeLinkGroups(self):
         self.checkDb()
-        self.keep_online()
-        self.cursor.execute("INSERT INTO result VALUES (?,?,?)", (hash_str, fname, size))
+        self.flush()
+        self.cursor.execute("""
+            INSERT INTO result SELECT groupId, path, size FROM links
+            WHERE groupId IN (SELECT groupId FROM links GROUP BY groupId HAVING COUNT(*) > 1)
+        """)
+        self.connection.commit()
+
+    def groupedFiles(self):
+        return self.streamQuery("SELECT groupId, path, size FROM result ORDER BY groupId, path", ())
+
+    def groupedFilesBySize(self):
+        return self.streamQuery("""
+            SELECT r.groupId, r.path, r.size FROM result r
+            JOIN (SELECT groupId, COUNT(*) AS cnt FROM result GROUP BY groupId) g ON r.groupId = g.groupId
+            ORDER BY r.size * g.cnt DESC, r.groupId, r.path
+        """, ())
+
+    def clearResults(self):
+        self.checkDb()
+        self.flush()
+        self.cursor.execute("DELETE FROM result")
         self.connection.commit()
 
+    def hashedPaths(self) -> set:
+        return set(row[0] for row in self.streamQuery("SELECT path FROM files WHERE algo=?", (DBEngine.HashAlgo,)))
+
+    def writeCheckpoint(self, key: str, value: str):
+        self.checkDb()
+        self.flush()
+        self.cursor.execute("INSERT OR REPLACE INTO checkpoint VALUES (?,?)", (key, str(value)))
+        self.connection.commit()
+
+    def readCheckpoint(self, key: str):
+        self.checkDb()
+        row = self.cursor.execute("SELECT value FROM checkpoint WHERE key=?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def commitBatch(self, files: list, groups: list, log: list, links: list):
+        # no log table in sqlite
+        self.checkDb()
+        self.cursor.executemany("INSERT OR IGNORE INTO files VALUES (?,?,?,?)", [(path, hash_str, size, DBEngine.HashAlgo) for path, hash_str, size in files])
+        self.cursor.executemany("INSERT INTO result VALUES (?,?,?)", groups)
+        self.cursor.executemany("INSERT OR IGNORE INTO links VALUES (?,?,?)", links)
+        self.connection.commit()
+
+class MemoryEngine(DBEngine):
+    # no server, no file. for laptops and CI boxes
+    def __init__(self):
+        super().__init__()
+        self.files = None
+        self.results = None
+        self.links = None
+
+    def open(self, path = None):
+        self.makeDb()
+
+    def checkDb(self):
+        if self.files is None:
+            raise Exception('dbEngine', 'not opened')
+
+    def makeDb(self):
+        self.files = {}
+        self.results = []
+        self.links = {}
+
+    def close(self):
+        self.files = None
+        self.results = None
+        self.links = None
+
+    def sizeGroups(self):
+        # (hash, size, groupId, files) of every not unique (hash, size), in hash and size order
+        self.checkDb()
+        self.flush()
+        for key in sorted(key for key in self.files if key[0] == DBEngine.HashAlgo):
+            bySize = {}
+            for path, size in self.files[key]:
+                bySize.setdefault(size, []).append((path, size))
+            groups = [(size, files) for size, files in sorted(bySize.items()) if len(files) > 1]
+            for size, files in groups:
+                yield key[1], size, key[1] if len(groups) == 1 else "%s.%d" % (key[1], size), files
+
+    def notUniqueHashes(self):
+        return list(dict.fromkeys(group[0] for group in self.sizeGroups()))
+
+    def filesByHash(self, hash_str: str):
+        self.checkDb()
+        self.flush()
+        return list(self.files.get((DBEngine.HashAlgo, hash_str), []))
+
+    def duplicatesCount(self) -> int:
+        return sum(1 for _ in self.sizeGroups())
+
+    def duplicateFiles(self):
+        for _, _, groupId, files in self.sizeGroups():
+            for path, size in sorted(files):
+                yield (groupId, path, size)
+
+    def storeDuplicateGroups(self):
+        self.checkDb()
+        self.flush()
+        self.results.extend(self.duplicateFiles())
+
+    def storeLinkGroups(self):
+        self.checkDb()
+        self.flush()
+        for groupId, files in self.links.items():
+            if len(files) > 1:
+                self.results.extend((groupId, path, size) for path, size in files)
+
+    def clearResults(self):
+        self.checkDb()
+        self.flush()
+        self.results = []
+
+    def groupedFiles(self):
+        self.checkDb()
+        self.flush()
+        return iter(sorted(self.results))
+
+    def groupedFilesBySize(self):
+        self.checkDb()
+        self.flush()
+        counts = {}
+        for groupId, _, _ in self.results:
+            counts[groupId] = counts.get(groupId, 0) + 1
+        return iter(sorted(self.results, key=lambda row: (-row[2] * counts[row[0]], row[0], row[1])))
+
+    def commitBatch(self, files: list, groups: list, log: list, links: list):
+        self.checkDb()
+        for path, hash_str, size in files:
+            self.files.setdefault((DBEngine.HashAlgo, hash_str), []).append((path, size))
+        self.results.extend(groups)
+        for groupId, path, size in links:
+            self.links.setdefault(groupId, []).append((path, size))
+
+    def cleanup(self):
+        self.checkDb()
+        self.flush()
+        self.files = {}
+        self.links = {}
+
 def makeEngine(type: str) -> DBEngine:
     if type.lower() == DBEngine.StoragePG:
         return PGEngine()
     if type.lower() == DBEngine.StorageSqlite:
         return SqliteEngine()
+    if type.lower() == DBEngine.StorageMemory:
+        return MemoryEngine()
     raise ValueError("no %s storage" % type)
@@ -1,6 +1,7 @@
+import os
+import stat
+import html
 import common
-from bs4 import BeautifulSoup as bs
-from operator import itemgetter
 
 class HTMLGenerator:
     def __init__(self):
@@ -96,36 +97,55 @@ class HTMLGenerator:
 
     def makeSection(self, hash, size, files) -> str:
         count = len(files)
-        text = "<div class='tableHeader'>%s. count: <b>%d</b>. total size: <b>%s</b></div>" % (hash, count, common.StrUtils.convert_bytes(size * count))
-        text += "<table><tr><td class='tableHeaderCell'>Path</td><td class='tableHeaderCell'>Size</td></tr>"
+        text = "<div class='tableHeader'>%s. count: <b>%d</b>. total size: <b>%s</b></div>\n" % (hash, count, common.StrUtils.convert_bytes(size * count))
+        text += "<table><tr><td class='tableHeaderCell'>Path</td><td class='tableHeaderCell'>Size</td></tr>\n"
         for path in files:
-            text += "<tr><td>%s</td><td>%s</td></tr>" % (common.StrUtils.readablePath(path), common.StrUtils.convert_bytes(size))
-        text += "</table>" + self.footer
+            text += "<tr><td>%s</td><td>%s</td></tr>\n" % (html.escape(common.StrUtils.readablePath(path)), common.StrUtils.convert_bytes(size))
+        text += "</table>\n"
         return text
 
-    def makeRmSection(self, sectionslist) -> str:
-        text = "<br><div class='tableHeader'>Remove duplicates shell command</span><pre>\n#!/bin/bash\n\n"
-        for entry in sectionslist:
-            for fname in entry["path"][1:]:
-                text += "rm -v \"%s\"\n" % fname
-        if not sectionslist:
-            text += "# no duplicartes\n"
-        text += "\necho \"done!\"\n</pre><br>"
-        return text
-
-    def generate(self, group, baseFolder) -> str:
-        htmltext = self.makeHeader(f"Duplicates report in {baseFolder}")
-        if group:
-            for h in group.keys():
-                group[h]["h"] = h
-                group[h]["summ"] = len(group[h]["path"]) * group[h]["size"]
+    def writeRmSection(self, out, groups, verified: bool):
+        out.write("<br><div class='tableHeader'>Remove duplicates shell command</div><pre>\n#!/bin/bash\n\n")
+        # groups of a short hash may join different files. without a strong hash or a byte compare every rm is commented out
+        prefix = ""
+        if not verified:
+            prefix = "# "
+            out.write("# groups are not verified by a strong hash or by content. run with --verify or --compare to enable the commands\n\n")
+        empty = True
+        for _, _, paths in groups:
+            # archive members (archive:/member) are not files. the first file on disk is kept.
+            # one path per inode: removing a hardlink of a kept file frees nothing, link groups drop out here
+            onDisk = []
+            inodes = set()
+            for fname in paths:
+                if ":/" in fname:
+                    continue
+                try:
+                    st = os.stat(fname)
+                except OSError:
+                    continue
+                if stat.S_ISREG(st.st_mode) and (st.st_dev, st.st_ino) not in inodes:
+                    inodes.add((st.st_dev, st.st_ino))
+                    onDisk.append(fname)
+            if len(onDisk) < 2:
+                continue
+            empty = False
+            for fname in onDisk[1:]:
+                out.write(html.escape("%srm -v \"%s\"\n" % (prefix, fname)))
+        if empty:
+            out.write("# no duplicartes\n")
+        out.write("\necho \"done!\"\n</pre><br>\n")
 
-            sortedData = sorted(group.values(), key=itemgetter("summ"), reverse=True)
-            for entry in sortedData:
-                htmltext += self.makeSection(entry["h"], entry["size"], entry["path"])
-            htmltext += self.makeRmSection(sortedData)
-        else: # nodup
-            htmltext += f"<div class='nodupLine'>No duplicates in {baseFolder}</div>"
-        htmltext += self.footer
-        soup = bs(htmltext, 'html.parser')
-        return soup.prettify()
+    def write(self, out, makeGroups, baseFolder, verified: bool = True):
+        # makeGroups() returns a fresh (groupId, size, paths) iterator, largest groups first.
+        # it is called twice: sections and the rm script. verified - groups are checked by a strong hash or by content
+        out.write(self.makeHeader(html.escape(f"Duplicates report in {baseFolder}")))
+        empty = True
+        for hash, size, paths in makeGroups():
+            empty = False
+            out.write(self.makeSection(hash, size, paths))
+        if empty:
+            out.write("<div class='nodupLine'>No duplicates in %s</div>\n" % html.escape(baseFolder))
+        else:
+            self.writeRmSection(out, makeGroups(), verified)
+        out.write(self.footer)
@@ -0,0 +1,130 @@
+import os
+import json
+import sqlite3
+
+class HashCache:
+    # digest is reused only if (device, inode, size, mtime_ns) and the algorithm are unchanged
+    CommitInterval = 1000
+
+    def __init__(self):
+        self.connection = None
+        self.cursor = None
+        self.path = ""
+        self.runId = 0
+        self.pending = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def makeKey(st: os.stat_result) -> tuple:
+        return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def open(self, path: str, runId: int):
+        self.path = path
+        self.runId = runId
+        self.connection = sqlite3.connect(path)
+        self.cursor = self.connection.cursor()
+        self.makeDb()
+
+    def checkDb(self):
+        if not self.cursor or not self.connection:
+            raise Exception('hashCache', 'not opened')
+
+    def makeDb(self):
+        self.checkDb()
+        self.cursor.execute("""
+            CREATE TABLE IF NOT EXISTS 'cache' (
+                'path' TEXT NOT NULL PRIMARY KEY,
+                'dev' INTEGER NOT NULL,
+                'ino' INTEGER NOT NULL,
+                'size' INTEGER NOT NULL,
+                'mtime_ns' INTEGER NOT NULL,
+                'algo' TEXT NOT NULL,
+                'hash' TEXT NOT NULL,
+                'seen' INTEGER NOT NULL);
+        """)
+        self.cursor.execute("""CREATE INDEX IF NOT EXISTS 'inode_i' ON 'cache' ('dev', 'ino');""")
+        # member listings of archives, keyed by the archive's own digest
+        self.cursor.execute("""
+            CREATE TABLE IF NOT EXISTS 'archives' (
+                'digest' TEXT NOT NULL,
+                'algo' TEXT NOT NULL,
+                'depth' INTEGER NOT NULL,
+                'members' TEXT NOT NULL,
+                'seen' INTEGER NOT NULL,
+                PRIMARY KEY ('digest', 'algo', 'depth'));
+        """)
+        self.connection.commit()
+
+    def lookup(self, path: str, key: tuple, algo: str):
+        self.checkDb()
+        dev, ino, size, mtime_ns = key
+        row = self.cursor.execute("SELECT hash FROM cache WHERE dev=? AND ino=? AND size=? AND mtime_ns=? AND algo=? LIMIT 1",
+            (dev, ino, size, mtime_ns, algo)).fetchone()
+        if not row:
+            self.misses += 1
+            return None
+        self.hits += 1
+        # the same inode can be reached by another path (rename, hardlink)
+        self.store(path, key, algo, row[0])
+        return row[0]
+
+    def store(self, path: str, key: tuple, algo: str, hash_str: str):
+        self.checkDb()
+        dev, ino, size, mtime_ns = key
+        path = os.path.abspath(path)
+        self.cursor.execute("INSERT OR REPLACE INTO cache VALUES (?,?,?,?,?,?,?,?)", (path, dev, ino, size, mtime_ns, algo, hash_str, self.runId))
+        self.pending += 1
+        if self.pending >= HashCache.CommitInterval:
+            self.commit()
+
+    def lookupArchive(self, digest: str, algo: str, depth: int):
+        self.checkDb()
+        row = self.cursor.execute("SELECT members FROM archives WHERE digest=? AND algo=? AND depth=?", (digest, algo, depth)).fetchone()
+        if not row:
+            return None
+        self.cursor.execute("UPDATE archives SET seen=? WHERE digest=? AND algo=? AND depth=?", (self.runId, digest, algo, depth))
+        self.pending += 1
+        return [tuple(member) for member in json.loads(row[0])]
+
+    def storeArchive(self, digest: str, algo: str, depth: int, members: list):
+        self.checkDb()
+        self.cursor.execute("INSERT OR REPLACE INTO archives VALUES (?,?,?,?,?)", (digest, algo, depth, json.dumps(members), self.runId))
+        self.pending += 1
+        if self.pending >= HashCache.CommitInterval:
+            self.commit()
+
+    def commit(self):
+        if self.connection and self.pending:
+            self.connection.commit()
+        self.pending = 0
+
+    def evict(self, root: str) -> int:
+        # drop entries under root that were not touched by this run and are gone or changed on disk
+        self.checkDb()
+        root = os.path.abspath(root).rstrip("/")
+        stale = []
+        rows = self.cursor.execute("SELECT path, dev, ino, size, mtime_ns FROM cache WHERE seen<>? AND (path=? OR substr(path, 1, ?)=?)",
+            (self.runId, root, len(root) + 1, root + "/")).fetchall()
+        for path, dev, ino, size, mtime_ns in rows:
+            try:
+                if HashCache.makeKey(os.stat(path)) == (dev, ino, size, mtime_ns):
+                    continue
+            except OSError:
+                pass
+            stale.append((path,))
+        self.cursor.executemany("DELETE FROM cache WHERE path=?", stale)
+        # listings of archives that no cached file has anymore
+        self.cursor.execute("DELETE FROM archives WHERE seen<>? AND NOT EXISTS (SELECT 1 FROM cache WHERE cache.hash=archives.digest AND cache.algo=archives.algo)",
+            (self.runId,))
+        evicted = len(stale) + self.cursor.rowcount
+        self.connection.commit()
+        self.pending = 0
+        return evicted
+
+    def close(self):
+        self.commit()
+        self.cursor = None
+        if self.connection:
+            self.connection.close()
+        self.connection = None
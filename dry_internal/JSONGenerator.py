@@ -0,0 +1,14 @@
+import json
+
+class JSONGenerator:
+    # same layout as json.dumps(groups, sort_keys=True, indent=2), written group by group
+    def write(self, out, groups):
+        empty = True
+        out.write("{")
+        for groupId, size, paths in groups:
+            out.write("\n" if empty else ",\n")
+            empty = False
+            out.write("  %s: {\n    \"path\": [\n" % json.dumps(groupId))
+            out.write(",\n".join("      " + json.dumps(path) for path in paths))
+            out.write("\n    ],\n    \"size\": %d\n  }" % size)
+        out.write("}" if empty else "\n}")
@@ -0,0 +1,59 @@
+import os
+import time
+import datetime
+import threading
+import collections
+
+class LogWriter(threading.Thread):
+    # writes log lines off the calling thread, one flush per batch instead of one per line.
+    # a deque append is all the caller pays; the writer wakes up every interval seconds or when
+    # the backlog reaches half of maxQueue. at maxQueue the caller waits, memory stays bounded
+    def __init__(self, logfile, maxQueue: int = 100000, interval: float = 0.2):
+        super().__init__(name="logger", daemon=True)
+        self.logfile = logfile
+        self.maxQueue = maxQueue
+        self.interval = interval
+        self.lines = collections.deque()
+        self.wake = threading.Event()
+        self.stopped = False
+        self.closed = False
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self.afterFork)
+
+    def afterFork(self):
+        # a forked child (a pool worker) has no writer thread. the queue and the file belong to the parent
+        self.lines = collections.deque()
+        self.stopped = True
+        self.closed = True
+
+    def write(self, stamp: float, msg: str):
+        if self.closed:
+            return
+        if len(self.lines) >= self.maxQueue // 2:
+            self.wake.set()
+            while len(self.lines) >= self.maxQueue and self.is_alive():
+                time.sleep(0.001)
+        self.lines.append((stamp, msg))
+
+    def drain(self):
+        lines = self.lines
+        while lines:
+            stamp, msg = lines.popleft()
+            self.logfile.write("[%s] %s \n" % (datetime.datetime.fromtimestamp(stamp), msg))
+        self.logfile.flush()
+
+    def run(self):
+        while not self.stopped:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            self.drain()
+        self.drain()
+
+    def close(self):
+        # everything written so far reaches the file
+        if self.closed:
+            return
+        self.closed = True
+        self.stopped = True
+        self.wake.set()
+        self.join()
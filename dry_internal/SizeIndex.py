@@ -0,0 +1,47 @@
+class SizeEntry:
+    def __init__(self, path: str, printableFileName: str, size: int, hashed: bool, statKey = None):
+        self.path = path
+        self.printableFileName = printableFileName
+        self.size = size
+        self.hashed = hashed
+        self.statKey = statKey
+
+class SizeIndex:
+    # files with a unique size cannot have a duplicate, so only shared sizes are worth hashing
+    def __init__(self):
+        self.entries = {}
+        self.totalCount = 0
+        self.totalSize = 0
+
+    def add(self, path: str, printableFileName: str, size: int, hashed: bool = False, statKey = None):
+        self.entries.setdefault(size, []).append(SizeEntry(path, printableFileName, size, hashed, statKey))
+        self.totalCount += 1
+        self.totalSize += size
+
+    def groups(self):
+        for size, group in self.entries.items():
+            if len(group) > 1:
+                yield size, group
+
+    def candidates(self):
+        for _, group in self.groups():
+            for entry in group:
+                if not entry.hashed:
+                    yield entry
+
+    def candidatesCount(self) -> int:
+        return sum(len(group) for _, group in self.groups())
+
+    def candidatesSize(self) -> int:
+        return sum(size * len(group) for size, group in self.groups())
+
+    def uniqueCount(self) -> int:
+        return self.totalCount - self.candidatesCount()
+
+    def uniqueSize(self) -> int:
+        return self.totalSize - self.candidatesSize()
+
+    def clear(self):
+        self.entries = {}
+        self.totalCount = 0
+        self.totalSize = 0
@@ -0,0 +1,201 @@
+import os
+import stat
+import queue
+import threading
+import collections
+import concurrent.futures
+
+class WalkEntry:
+    def __init__(self, path: str, st: os.stat_result):
+        self.path = path
+        self.stat = st
+        # archive check result, filled by the first consumer that asks. None - not checked yet
+        self.archive = None
+
+    @property
+    def size(self) -> int:
+        return self.stat.st_size
+
+class WalkStats:
+    def __init__(self):
+        self.dirs = 0
+        self.files = 0
+        self.skipped = 0
+        self.syscalls = 0
+
+    def syscallsPerFile(self) -> float:
+        return self.syscalls / self.files if self.files else 0.0
+
+    def __str__(self) -> str:
+        return "walker: %d dirs, %d files, %d skipped, %d syscalls (%.2f per file)" % (
+            self.dirs, self.files, self.skipped, self.syscalls, self.syscallsPerFile())
+
+class Walker:
+    # iterative os.scandir walk. the dir listing already tells links, files and folders apart
+    # (d_type), so a regular file costs one lstat and a folder one scandir.
+    # with concurrency > 1 several folders are read at once by a thread pool, which hides
+    # round trips on network mounts; files then come in folder completion order.
+    # a single thread keeps the depth-first order of the old recursive listdir walk
+    File = "file"
+    Folder = "folder"
+    Skip = "skip"
+    Error = "error"
+
+    def __init__(self, onSkip = None, onError = None, concurrency: int = 1):
+        self.onSkip = onSkip
+        self.onError = onError
+        self.concurrency = max(1, concurrency)
+        self.stats = WalkStats()
+
+    @staticmethod
+    def readFolder(path: str) -> tuple:
+        # runs in pool threads, so it only returns what it found. stats and callbacks stay with the caller
+        items = []
+        syscalls = 1
+        try:
+            with os.scandir(path) as it:
+                entries = list(it)
+        except OSError as e:
+            return [(Walker.Error, path, e)], syscalls
+        for entry in entries:
+            entryPath = path + "/" + entry.name
+            try:
+                if entry.is_symlink():
+                    items.append((Walker.Skip, entryPath, "link"))
+                elif entry.is_dir(follow_symlinks=False):
+                    items.append((Walker.Folder, entryPath, None))
+                elif entry.is_file(follow_symlinks=False):
+                    syscalls += 1
+                    items.append((Walker.File, entryPath, entry.stat(follow_symlinks=False)))
+                else:
+                    items.append((Walker.Skip, entryPath, "not a file or folder"))
+            except OSError as e:
+                items.append((Walker.Error, entryPath, e))
+        return items, syscalls
+
+    def listFolder(self, readResult: tuple) -> list:
+        items, syscalls = readResult
+        self.stats.dirs += 1
+        self.stats.syscalls += syscalls
+        return items
+
+    def account(self, item: tuple):
+        # returns a WalkEntry for a file, None for anything else
+        kind, path, payload = item
+        if kind == Walker.File:
+            self.stats.files += 1
+            return WalkEntry(path, payload)
+        if kind == Walker.Skip:
+            self.stats.skipped += 1
+            if self.onSkip:
+                self.onSkip(path, payload)
+        elif kind == Walker.Error:
+            self.stats.skipped += 1
+            if self.onError:
+                self.onError(path, payload)
+        return None
+
+    def walk(self, root: str):
+        self.stats.syscalls += 1
+        try:
+            st = os.lstat(root)
+        except OSError as e:
+            self.account((Walker.Error, root, e))
+            return
+        if stat.S_ISLNK(st.st_mode):
+            self.account((Walker.Skip, root, "link"))
+        elif stat.S_ISREG(st.st_mode):
+            yield self.account((Walker.File, root, st))
+        elif not stat.S_ISDIR(st.st_mode):
+            self.account((Walker.Skip, root, "not a file or folder"))
+        elif self.concurrency > 1:
+            yield from self.walkConcurrent(root)
+        else:
+            yield from self.walkSerial(root)
+
+    def walkSerial(self, root: str):
+        stack = [iter(self.listFolder(Walker.readFolder(root)))]
+        while stack:
+            item = next(stack[-1], None)
+            if item is None:
+                stack.pop()
+            elif item[0] == Walker.Folder:
+                stack.append(iter(self.listFolder(Walker.readFolder(item[1]))))
+            else:
+                entry = self.account(item)
+                if entry:
+                    yield entry
+
+    def walkConcurrent(self, root: str):
+        # at most 2 * concurrency folder reads are queued, the rest wait here as plain paths
+        folders = collections.deque([root])
+        pending = set()
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="walker")
+        try:
+            while folders or pending:
+                while folders and len(pending) < 2 * self.concurrency:
+                    pending.add(pool.submit(Walker.readFolder, folders.pop()))
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    for item in self.listFolder(future.result()):
+                        if item[0] == Walker.Folder:
+                            folders.append(item[1])
+                            continue
+                        entry = self.account(item)
+                        if entry:
+                            yield entry
+        finally:
+            for future in pending:
+                future.cancel()
+            pool.shutdown(wait=False)
+
+class WalkThread(threading.Thread):
+    # enumerates the tree ahead of the consumer and reports every file to onEntry,
+    # so the totals grow while the same entries are being indexed.
+    # the queue is bounded: on a huge tree the totals stay a lower bound until the consumer catches up
+    def __init__(self, walker: Walker, root: str, onEntry = None, onDone = None, maxQueue: int = 1000000):
+        super().__init__(name="walker", daemon=True)
+        self.walker = walker
+        self.root = root
+        self.onEntry = onEntry
+        self.onDone = onDone
+        self.queue = queue.Queue(maxQueue)
+        self.stopped = threading.Event()
+        self.done = False
+        self.error = None
+
+    def put(self, item) -> bool:
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def run(self):
+        try:
+            for entry in self.walker.walk(self.root):
+                if self.onEntry:
+                    self.onEntry(entry)
+                if not self.put(entry):
+                    return
+        except Exception as e:
+            self.error = e
+        self.done = True
+        if self.onDone:
+            self.onDone()
+        self.put(None)
+
+    def entries(self):
+        self.start()
+        try:
+            while True:
+                entry = self.queue.get()
+                if entry is None:
+                    break
+                yield entry
+        finally:
+            self.stopped.set()
+        if self.error:
+            raise self.error
@@ -0,0 +1,161 @@
+import os
+import queue
+import datetime
+import traceback
+import multiprocessing
+
+from . import DBEngine, hasher, HashCache, ArchiveReader
+
+# per-process state of a pool worker. one db connection for the whole worker lifetime.
+# without pg settings workers only hash and the parent writes the results
+workerState = {}
+
+def timeOffset(initialTime: datetime.datetime):
+    diff = (datetime.datetime.now() - initialTime)
+    return diff.microseconds
+
+def initWorker(pgSettngs, initialTime: datetime.datetime, hashAlgo: str, chunkSize: int, tmpBase: str, archDepth: int, archBudget: int, flushPolicy: tuple, nodeKeys: tuple):
+    # spawn and forkserver workers do not inherit the module state of the parent, everything is set again
+    hasher.setChunkSize(chunkSize)
+    DBEngine.DBEngine.setHashAlgo(hashAlgo)
+    DBEngine.DBEngine.setFlushPolicy(*flushPolicy)
+    DBEngine.PGEngine.makeNodeKeys(*nodeKeys)
+    dbEngine = None
+    if pgSettngs:
+        dbEngine = DBEngine.PGEngine()
+        dbEngine.open(pgSettngs)
+    workerState["dbEngine"] = dbEngine
+    workerState["initialTime"] = initialTime
+    workerState["hashAlgo"] = hashAlgo
+    workerState["tmpBase"] = tmpBase
+    workerState["archDepth"] = archDepth
+    workerState["archBudget"] = archBudget
+
+def hashOne(path: str, printableFileName: str) -> tuple:
+    dbEngine = workerState["dbEngine"]
+    initialTime = workerState["initialTime"]
+    try:
+        cacheKey = HashCache.HashCache.makeKey(os.stat(path))
+        hashStr = hasher.hashFile(path, None, workerState["hashAlgo"])
+        if dbEngine:
+            dbEngine.writeFileInfo(printableFileName, hashStr, cacheKey[2])
+    except Exception as e:
+        tb = traceback.format_exc()
+        e_msg = "cannot read file %s  exception: %s, tb: %s" % (path, str(e), str(tb))
+        if dbEngine:
+            dbEngine.writeLog(timeOffset(initialTime), DBEngine.DbLogLevel.Error, e_msg)
+        return (printableFileName, path, 0, "", None, e_msg)
+    return (printableFileName, path, cacheKey[2], hashStr, cacheKey, "")
+
+def hashBatch(batch: list) -> list:
+    dbEngine = workerState["dbEngine"]
+    initialTime = workerState["initialTime"]
+    before = datetime.datetime.now()
+    rc = [hashOne(path, printableFileName) for path, printableFileName in batch]
+    if dbEngine:
+        dbEngine.writeLog(timeOffset(initialTime), DBEngine.DbLogLevel.Debug, "batch of %d files DONE in %s" % (len(batch), (datetime.datetime.now() - before)))
+        # one transaction per batch. nothing may stay buffered when the pool shuts down
+        dbEngine.flush()
+    return rc
+
+def hashArchive(path: str, printableFileName: str, digest: str, statKey, resumed: set) -> list:
+    # one archive per task. members come back with an empty path, they have no file of their own.
+    # in place of the stat key they carry (archive digest, archive name, member) for the archive index.
+    # without a digest the archive is hashed here first. with a stat key it comes back as a file too.
+    # resumed members are already in the db
+    dbEngine = workerState["dbEngine"]
+    rc = []
+    if digest is None:
+        try:
+            digest = hasher.hashFile(path, None, workerState["hashAlgo"])
+        except Exception as e:
+            return [(printableFileName, path, 0, "", None, "cannot read archive %s  exception: %s" % (path, str(e)))]
+        if statKey:
+            if dbEngine:
+                dbEngine.writeFileInfo(printableFileName, digest, statKey[2])
+            rc.append((printableFileName, path, statKey[2], digest, statKey, ""))
+    try:
+        for member, size, hashStr, err in ArchiveReader.readMembers(path, workerState["hashAlgo"], workerState["tmpBase"], workerState["archDepth"], workerState["archBudget"]):
+            memberName = ArchiveReader.memberName(printableFileName, member)
+            if err:
+                rc.append((memberName, "", 0, "", (digest, printableFileName, None), "cannot read %s  exception: %s" % (memberName, err)))
+                continue
+            if dbEngine and memberName not in resumed:
+                dbEngine.writeFileInfo(memberName, hashStr, size)
+            rc.append((memberName, "", size, hashStr, (digest, printableFileName, member), ""))
+    except Exception as e:
+        rc.append((printableFileName, "", 0, "", (digest, printableFileName, None), "cannot read archive %s  exception: %s" % (path, str(e))))
+    if dbEngine:
+        dbEngine.flush()
+    return rc
+
+class WorkerPool:
+    # long-lived worker processes. work goes out in batches, results come back in completion order
+    def __init__(self, size: int, batchSize: int, pgSettngs, initialTime: datetime.datetime, hashAlgo: str, chunkSize: int, tmpBase: str, archDepth: int, archBudget: int):
+        self.size = size
+        self.batchSize = max(1, batchSize)
+        self.maxInFlight = 2 * size
+        self.inFlight = 0
+        self.batch = []
+        self.results = queue.Queue()
+        self.pool = multiprocessing.Pool(size, initializer=initWorker, initargs=(pgSettngs, initialTime, hashAlgo, chunkSize, tmpBase, archDepth, archBudget,
+            (DBEngine.DBEngine.FlushRows, DBEngine.DBEngine.FlushInterval), (DBEngine.PGEngine.ProduccerId, DBEngine.PGEngine.SessionId)))
+
+    def onError(self, e):
+        self.results.put([("", "", 0, "", None, "worker batch failed: %s" % str(e))])
+
+    def submit(self, path: str, printableFileName: str) -> list:
+        self.batch.append((path, printableFileName))
+        if len(self.batch) < self.batchSize:
+            return self.collect(False)
+        return self.dispatch()
+
+    def submitArchive(self, path: str, printableFileName: str, digest: str, statKey, resumed: set) -> list:
+        # archives are big tasks of their own, several of them are read by different workers at once
+        rc = []
+        while self.inFlight >= self.maxInFlight:
+            rc.extend(self.collect(True))
+        self.pool.apply_async(hashArchive, (path, printableFileName, digest, statKey, resumed), callback=self.results.put, error_callback=self.onError)
+        self.inFlight += 1
+        rc.extend(self.collect(False))
+        return rc
+
+    def dispatch(self) -> list:
+        rc = []
+        while self.inFlight >= self.maxInFlight:
+            rc.extend(self.collect(True))
+        if self.batch:
+            self.pool.apply_async(hashBatch, (self.batch,), callback=self.results.put, error_callback=self.onError)
+            self.inFlight += 1
+            self.batch = []
+        rc.extend(self.collect(False))
+        return rc
+
+    def collect(self, block: bool) -> list:
+        rc = []
+        while self.inFlight:
+            try:
+                batchResult = self.results.get(block=block)
+            except queue.Empty:
+                break
+            block = False
+            self.inFlight -= 1
+            rc.extend(batchResult)
+        return rc
+
+    def drain(self) -> list:
+        # everything submitted so far. the pool stays up
+        rc = self.dispatch()
+        while self.inFlight:
+            rc.extend(self.collect(True))
+        return rc
+
+    def join(self) -> list:
+        rc = self.drain()
+        self.pool.close()
+        self.pool.join()
+        return rc
+
+    def terminate(self):
+        self.pool.terminate()
+        self.pool.join()
@@ -13,10 +13,22 @@ class Stats:
     def __init__(self):
         self.totalCount = 0
         self.totalSize = 0
+        # totals are final once the enumeration is over
+        self.totalDone = False
         self.startTime = common.mstime()
         self.filesCount = 0
         self.filesSize = 0
 #########################################################################################################
+class StageStats:
+    def __init__(self, name: str):
+        self.name = name
+        self.files = 0
+        self.bytesRead = 0
+        self.bytesSaved = 0
+
+    def __str__(self) -> str:
+        return "%s: %d files, read %s, saved %s" % (self.name, self.files, common.StrUtils.convert_bytes(self.bytesRead), common.StrUtils.convert_bytes(self.bytesSaved))
+#########################################################################################################
 class Formats(enum.Enum):
     json = 0
     stdout = 1
@@ -1,24 +1,178 @@
 import os
-import hashlib
+import threading
+from common import HasherFactory
 
-def hashFile(fname: str, onProgressStr = None):
-    hasher = hashlib.sha512()
-    block_size = 128 * hasher.block_size
-    with open(fname, 'rb') as a_file:
-        chunk = a_file.read(block_size)
-        processedSize = block_size
-        fSize = os.path.getsize(fname)
+# bytes per read. one preallocated buffer per thread is reused for every file
+DefaultChunkSize = 256 * 1024
+ChunkSize = DefaultChunkSize
+buffers = threading.local()
+
+def setChunkSize(size: int):
+    global ChunkSize
+    ChunkSize = size if size > 0 else DefaultChunkSize
+
+def readBuffer() -> bytearray:
+    rc = getattr(buffers, "buffer", None)
+    if rc is None or len(rc) != ChunkSize:
+        rc = buffers.buffer = bytearray(ChunkSize)
+    return rc
+
+def adviseSequential(fd: int):
+    # bigger readahead for us, and the pages we read are not worth keeping
+    if hasattr(os, "posix_fadvise"):
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        except OSError:
+            pass
+
+def adviseDone(fd: int):
+    if hasattr(os, "posix_fadvise"):
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        except OSError:
+            pass
+
+def readFull(a_file, view: memoryview) -> int:
+    # readinto may return short reads on network mounts. fill the buffer unless it is eof
+    total = 0
+    while total < len(view):
+        n = a_file.readinto(view[total:])
+        if not n:
+            break
+        total += n
+    return total
+
+def hashFile(fname: str, onProgress = None, algo: str = HasherFactory.Default):
+    # onProgress(fname, done, total) after every chunk
+    hasher = HasherFactory.createHasher(algo)
+    buffer = readBuffer()
+    view = memoryview(buffer)
+    with open(fname, 'rb', buffering=0) as a_file:
+        fd = a_file.fileno()
+        fSize = os.fstat(fd).st_size
         if fSize <= 0:
             return hasher.hexdigest()
-        while chunk:
-            prc = (processedSize / fSize) * 100.0
-            if onProgressStr:
-                onProgressStr("process file %s %0.3f%%" % (fname, prc))
-            hasher.update(chunk)
-            del chunk
-            chunk = a_file.read(block_size)
-            processedSize += block_size
+        adviseSequential(fd)
+        processedSize = 0
+        while True:
+            n = a_file.readinto(buffer)
+            if not n:
+                break
+            hasher.update(view[:n] if n < len(buffer) else buffer)
+            processedSize += n
+            if onProgress:
+                onProgress(fname, processedSize, fSize)
+        adviseDone(fd)
+    return hasher.hexdigest()
+
+def hashStream(a_file, algo: str = HasherFactory.Default, out = None) -> tuple:
+    # any readable stream, e.g. an archive member. returns (hash, size).
+    # with out the data is copied there in the same pass
+    hasher = HasherFactory.createHasher(algo)
+    buffer = readBuffer()
+    view = memoryview(buffer)
+    size = 0
+    while True:
+        n = a_file.readinto(buffer)
+        if not n:
+            break
+        chunk = view[:n] if n < len(buffer) else buffer
+        hasher.update(chunk)
+        if out:
+            out.write(chunk)
+        size += n
+    return hasher.hexdigest(), size
 
+# lockstep comparison keeps every file of a group open up to this count, above it files are reopened per block
+MaxOpenFiles = 256
+# read buffers of one lockstep comparison together
+CompareBudget = 64 * 1024 * 1024
+
+def splitIdentical(paths: list, onError = None) -> list:
+    # reads all files of a group block by block at the same time. each file is read once.
+    # a group splits as soon as its blocks differ, the parts go on separately and a part of one file is done.
+    # returns lists of paths with identical content. unreadable files are reported to onError and left out
+    count = len(paths)
+    blockSize = max(4096, min(ChunkSize, CompareBudget // max(1, count)))
+    blocks = [bytearray(blockSize) for _ in range(count)]
+    views = [memoryview(block) for block in blocks]
+    lengths = [0] * count
+    offsets = [0] * count
+    files = [None] * count
+    keepOpen = count <= MaxOpenFiles
+
+    def readBlock(i: int) -> bool:
+        try:
+            if not files[i] and keepOpen:
+                files[i] = open(paths[i], 'rb', buffering=0)
+                adviseSequential(files[i].fileno())
+            if files[i]:
+                lengths[i] = readFull(files[i], views[i])
+            else:
+                with open(paths[i], 'rb', buffering=0) as a_file:
+                    a_file.seek(offsets[i])
+                    lengths[i] = readFull(a_file, views[i])
+        except OSError as e:
+            if onError:
+                onError(paths[i], e)
+            return False
+        offsets[i] += lengths[i]
+        return True
+
+    def sameBlock(i: int, j: int) -> bool:
+        # bytearray compare is a memcmp, memoryview compare goes item by item
+        if lengths[i] != lengths[j]:
+            return False
+        if lengths[i] == blockSize:
+            return blocks[i] == blocks[j]
+        return blocks[i][:lengths[i]] == blocks[j][:lengths[j]]
+
+    def close(part: list):
+        for i in part:
+            if files[i]:
+                adviseDone(files[i].fileno())
+                files[i].close()
+                files[i] = None
+
+    rc = []
+    groups = [list(range(count))]
+    try:
+        while groups:
+            nextGroups = []
+            for group in groups:
+                parts = []
+                for i in group:
+                    if not readBlock(i):
+                        close([i])
+                        continue
+                    part = next((part for part in parts if sameBlock(part[0], i)), None)
+                    if part:
+                        part.append(i)
+                    else:
+                        parts.append([i])
+                for part in parts:
+                    if len(part) > 1 and lengths[part[0]] == blockSize:
+                        nextGroups.append(part)
+                    else:
+                        close(part)
+                        rc.append(part)
+            groups = nextGroups
+    finally:
+        close(range(count))
+    # parts in the order of their first file, not in the order they were done
+    return [[paths[i] for i in part] for part in sorted(rc)]
+
+def partialReadSize(size: int, chunkSize: int) -> int:
+    return min(size, 2 * chunkSize)
+
+def hashPartial(fname: str, size: int, chunkSize: int, algo: str = HasherFactory.Default) -> str:
+    # head and tail only. cheap pre-filter for same-size files
+    hasher = HasherFactory.createHasher(algo)
+    with open(fname, 'rb') as a_file:
+        hasher.update(a_file.read(chunkSize))
+        if size > chunkSize:
+            a_file.seek(max(size - chunkSize, chunkSize))
+            hasher.update(a_file.read(chunkSize))
     return hasher.hexdigest()
 
 class VideoHasher:
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# end-to-end dry benchmark: builds a synthetic tree and runs dry on it in several modes.
+# prints one JSON document: the tree, and per run files/s, MB/s, peak RSS and per-stage times (from --profile)
+# usage: bench_dry.py [--files 10000] [--min-size 1] [--max-size 1048576] [--dup 0.3] [--links 0.05]
+#                     [--archives 10] [--modes single,mp,sqlite,memory] [--repeat 1] [--seed 1] [--dir /tmp] [--keep]
+import os
+import re
+import sys
+import json
+import time
+import random
+import shutil
+import tarfile
+import zipfile
+import argparse
+import tempfile
+import subprocess
+
+bindir = os.path.dirname(os.path.abspath(__file__))
+dry = os.path.join(bindir, "..", "dry")
+logdir = os.path.join(bindir, "..", "log")
+
+# "single" runs with the storage of config.ini (sqlite by default), the others pin it.
+# a format in config.ini wins over -f, keep it json or unset
+Modes = {
+    "single": [],
+    "mp": ["--mp"],
+    "sqlite": ["--storage", "sqlite"],
+    "memory": ["--storage", "memory"],
+    "sizefirst": ["--sizefirst"],
+    "mp-sizefirst": ["--mp", "--sizefirst"],
+    "noarchive": ["--noarchive"],
+}
+
+# FolderProcessor methods that make up the stages
+Stages = ["indexTree", "hashCandidates", "joinPool", "groupRecords", "exec"]
+
+def makeTree(root: str, args) -> dict:
+    # sizes are log-uniform between min and max, so small files dominate the count and big ones the volume
+    rnd = random.Random(args.seed)
+    files = []
+    totalSize = 0
+    links = 0
+    for i in range(args.files):
+        folder = os.path.join(root, "d%03d" % (i % 100))
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, "f%07d" % i)
+        if files and rnd.random() < args.links:
+            os.link(rnd.choice(files), path)
+            links += 1
+        elif files and rnd.random() < args.dup:
+            shutil.copyfile(rnd.choice(files), path)
+        else:
+            size = int(round(2 ** rnd.uniform(args.min_size.bit_length() - 1, args.max_size.bit_length() - 1)))
+            with open(path, 'wb') as out:
+                out.write(rnd.randbytes(size))
+        files.append(path)
+        totalSize += os.path.getsize(path)
+    # archives repack files of the tree, so their members have duplicates outside
+    for i in range(args.archives):
+        members = rnd.sample(files, min(len(files), 10))
+        if i % 2:
+            path = os.path.join(root, "a%03d.zip" % i)
+            with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+                for member in members:
+                    archive.write(member, os.path.relpath(member, root))
+        else:
+            path = os.path.join(root, "a%03d.tar.gz" % i)
+            with tarfile.open(path, 'w:gz') as archive:
+                for member in members:
+                    archive.add(member, os.path.relpath(member, root))
+        totalSize += os.path.getsize(path)
+    return {"files": args.files + args.archives, "bytes": totalSize, "hardlinks": links, "archives": args.archives,
+            "dup": args.dup, "min_size": args.min_size, "max_size": args.max_size, "seed": args.seed}
+
+def parseProfile(stderr: str) -> dict:
+    # "FolderProcessor.indexTree   calls  1  total  15.3 ms ..."
+    stages = {}
+    for name, total in re.findall(r"^FolderProcessor\.(\w+)\s+calls\s+\d+\s+total\s+([\d.]+) ms", stderr, re.M):
+        if name in Stages:
+            stages[name] = float(total)
+    return stages
+
+def runDry(mode: str, root: str, outdir: str, tree: dict) -> dict:
+    target = os.path.join(outdir, mode + ".json")
+    cmd = [sys.executable, dry, "-q", "--profile", "-f", "json", "-o", target] + Modes[mode] + [root]
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, cwd=outdir)
+    stderr = proc.stderr.read().decode(errors="replace")
+    # wait4 gives the rusage of this child only. with --mp the workers are its children and are not included
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    elapsed = time.perf_counter() - start
+    run = {
+        "mode": mode,
+        "args": Modes[mode],
+        "rc": proc.returncode,
+        "seconds": round(elapsed, 3),
+    }
+    if proc.returncode != 0 or not os.path.isfile(target):
+        # a failed run has no throughput
+        run["rc"] = proc.returncode or 1
+        run["error"] = stderr[-4000:]
+        print("%s failed (rc %d):\n%s" % (mode, proc.returncode, stderr), file=sys.stderr)
+        return run
+    os.remove(target)
+    run.update({
+        "files_per_s": round(tree["files"] / elapsed, 1),
+        "mb_per_s": round(tree["bytes"] / elapsed / (1 << 20), 2),
+        # linux reports KB
+        "peak_rss_mb": round(usage.ru_maxrss / 1024, 1),
+        "stages_ms": parseProfile(stderr),
+    })
+    return run
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="dry end-to-end benchmark")
+    parser.add_argument("--files", type=int, default=10000, help="files in the tree (default 10000)")
+    parser.add_argument("--min-size", type=int, default=1, help="smallest file, bytes (default 1)")
+    parser.add_argument("--max-size", type=int, default=1 << 20, help="largest file, bytes (default 1 MB)")
+    parser.add_argument("--dup", type=float, default=0.3, help="share of files that copy an earlier one (default 0.3)")
+    parser.add_argument("--links", type=float, default=0.05, help="share of files that are hardlinks (default 0.05)")
+    parser.add_argument("--archives", type=int, default=10, help="zip and tar.gz archives of tree files (default 10)")
+    parser.add_argument("--modes", default="single,mp,sqlite,memory", help="comma separated: %s" % ",".join(Modes))
+    parser.add_argument("--repeat", type=int, default=1, help="runs per mode (default 1)")
+    parser.add_argument("--seed", type=int, default=1, help="tree generator seed (default 1)")
+    parser.add_argument("--dir", default=None, help="where to create the tree (default: system tmp)")
+    parser.add_argument("--keep", action="store_true", help="keep the tree and the dry logs")
+    args = parser.parse_args()
+
+    modes = args.modes.split(",")
+    for mode in modes:
+        if mode not in Modes:
+            parser.error("unknown mode %s" % mode)
+    folder = tempfile.mkdtemp(prefix="drybench", dir=args.dir)
+    logsBefore = set(os.listdir(logdir)) if os.path.isdir(logdir) else set()
+    try:
+        root = os.path.join(folder, "tree")
+        outdir = os.path.join(folder, "out")
+        os.makedirs(outdir)
+        start = time.perf_counter()
+        tree = makeTree(root, args)
+        tree["build_seconds"] = round(time.perf_counter() - start, 3)
+        runs = []
+        for mode in modes:
+            for _ in range(args.repeat):
+                runs.append(runDry(mode, root, outdir, tree))
+        print(json.dumps({"tree": tree, "runs": runs}, indent=2))
+    finally:
+        if not args.keep:
+            shutil.rmtree(folder, ignore_errors=True)
+            if os.path.isdir(logdir):
+                for name in set(os.listdir(logdir)) - logsBefore:
+                    os.remove(os.path.join(logdir, name))
+    return 0 if all(run["rc"] == 0 for run in runs) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
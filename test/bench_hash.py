@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# read throughput of dry hashing and comparing: the old read() loop against the readinto path.
+# usage: bench_hash.py [--size MB] [--algo sha512] [--chunks 16,256,1024,4096] [--repeat 3] [--dir /tmp]
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+bindir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(bindir + "/..")
+from common import HasherFactory
+from dry_internal import hasher
+
+def legacyHash(fname: str, algo: str) -> str:
+    # hasher.hashFile before the readinto rewrite: 16 KB bytes objects
+    h = HasherFactory.createHasher(algo)
+    with open(fname, 'rb') as a_file:
+        chunk = a_file.read(128 * 128)
+        while chunk:
+            h.update(chunk)
+            del chunk
+            chunk = a_file.read(128 * 128)
+    return h.hexdigest()
+
+def legacyCompare(path1: str, path2: str) -> bool:
+    # FolderProcessor.compareFiles before the lockstep rewrite: 10 KB bytes objects
+    with open(path1, 'rb') as f1, open(path2, 'rb') as f2:
+        chunk1 = f1.read(10240)
+        chunk2 = f2.read(10240)
+        while chunk1 and chunk2:
+            if chunk1 != chunk2:
+                return False
+            chunk1 = f1.read(10240)
+            chunk2 = f2.read(10240)
+    return True
+
+def warm(fname: str):
+    with open(fname, 'rb') as a_file:
+        while a_file.read(1 << 24):
+            pass
+
+def drop(fname: str):
+    with open(fname, 'rb') as a_file:
+        hasher.adviseDone(a_file.fileno())
+
+def measure(name: str, files: list, size: int, cold: bool, repeat: int, func):
+    # best of repeat runs
+    elapsed = None
+    for _ in range(repeat):
+        for fname in files:
+            if cold:
+                drop(fname)
+            else:
+                warm(fname)
+        start = time.perf_counter()
+        func()
+        spent = time.perf_counter() - start
+        elapsed = spent if elapsed is None else min(elapsed, spent)
+    print("%-28s %-5s %8.1f MB/s" % (name, "cold" if cold else "warm", size * len(files) / elapsed / (1 << 20)))
+
+def makeFile(fname: str, size: int):
+    block = os.urandom(1 << 20)
+    with open(fname, 'wb') as out:
+        for _ in range(size >> 20):
+            out.write(block)
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="dry read path benchmark")
+    parser.add_argument("--size", type=int, default=512, help="test file size in MB (default 512)")
+    parser.add_argument("--algo", default=HasherFactory.Default, help="hash algorithm (default %s)" % HasherFactory.Default)
+    parser.add_argument("--chunks", default="16,256,1024,4096", help="readinto chunk sizes in KB")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case, the best one is printed (default 3)")
+    parser.add_argument("--dir", default=None, help="where to create test files (default: system tmp)")
+    args = parser.parse_args()
+
+    size = args.size << 20
+    folder = tempfile.mkdtemp(prefix="drybench", dir=args.dir)
+    try:
+        file1 = folder + "/a"
+        file2 = folder + "/b"
+        makeFile(file1, size)
+        shutil.copyfile(file1, file2)
+        print("%d MB files in %s, %s" % (args.size, folder, args.algo))
+        for cold in [False, True]:
+            measure("hash read() 16K", [file1], size, cold, args.repeat, lambda: legacyHash(file1, args.algo))
+            for chunk in args.chunks.split(","):
+                hasher.setChunkSize(int(chunk) * 1024)
+                measure("hash readinto %sK" % chunk, [file1], size, cold, args.repeat, lambda: hasher.hashFile(file1, None, args.algo))
+            measure("compare read() 10K", [file1, file2], size, cold, args.repeat, lambda: legacyCompare(file1, file2))
+            for chunk in args.chunks.split(","):
+                hasher.setChunkSize(int(chunk) * 1024)
+                measure("compare readinto %sK" % chunk, [file1, file2], size, cold, args.repeat, lambda: hasher.splitIdentical([file1, file2]))
+    finally:
+        shutil.rmtree(folder)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())